@@ -0,0 +1,163 @@
+'''
+  Offline benchmarks of the Blink client against a local mockserver.MockServer
+
+    python benchmark.py                                  # all workloads
+    python benchmark.py listing archive --latency 0.05   # some workloads, slower server
+    python benchmark.py --json results.json              # keep the results for comparison
+
+  Every workload runs on a fresh connected client in its own process, apart from the server,
+  and reports the requests per second, the p50 and p99 latency of its requests, the MB/s
+  received and the peak RSS of that process.
+'''
+import argparse, json, shutil, sys, tempfile
+from collections import OrderedDict
+from time import monotonic
+
+import blink
+from mockserver import MockServer
+
+###############################################################################
+##  Workloads
+###############################################################################
+
+def listing(b):
+    b.list_all_events()
+
+def iterate(b):
+    for event in b.iter_events():
+        pass
+
+def sweep(b):
+    b.get_camera_info()
+    b.get_camera_sensor_info()
+
+def refresh(b):
+    b.refresh_all_cameras_thumbnail()
+
+def thumbnails(b):
+    for device in b.homescreen()['devices']:
+        b.download_thumbnail_home_v2(device)
+
+def archive(b):
+    path = tempfile.mkdtemp()
+    try:
+        b.archive(path)
+    finally:
+        shutil.rmtree(path)
+
+def delete(b):
+    b.delete_videos(where=lambda event: event.id % 10 == 0)
+
+WORKLOADS = OrderedDict([
+    ('listing', listing),
+    ('iterate', iterate),
+    ('sweep', sweep),
+    ('refresh', refresh),
+    ('thumbnails', thumbnails),
+    ('archive', archive),
+    ('delete', delete),
+])
+
+###############################################################################
+##  Measurement
+###############################################################################
+
+def peak_rss():
+    '''
+      Peak resident set size of the calling process in MB, None where unknown
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss / (1024.0 * 1024) if sys.platform == 'darwin' else rss / 1024.0
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def run(name, url, **options):
+    '''
+      Runs the workload name on a fresh client of the server at url, returns its measurements
+    '''
+    b = blink.Blink('benchmark@example.com', 'secret', base_url=url, **options)
+    b.connect()
+    requests = []
+    b.on_request_end.append(requests.append)
+    started = monotonic()
+    WORKLOADS[name](b)
+    elapsed = monotonic() - started
+    b.close()
+    durations = [info.duration for info in requests]
+    received = sum(info.bytes or 0 for info in requests)
+    return OrderedDict([
+        ('workload', name),
+        ('requests', len(requests)),
+        ('seconds', elapsed),
+        ('requests_per_second', len(requests) / elapsed if elapsed else 0.0),
+        ('p50_ms', percentile(durations, 0.5) * 1000 if durations else None),
+        ('p99_ms', percentile(durations, 0.99) * 1000 if durations else None),
+        ('mb_per_second', received / elapsed / (1024 * 1024) if elapsed else 0.0),
+        ('errors', sum(1 for info in requests if info.error is not None)),
+        ('peak_rss_mb', peak_rss()),
+    ])
+
+def run_isolated(name, url, **options):
+    '''
+      Same as run, in a new process so that its peak RSS is the workload's alone
+    '''
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(run, name, url, **options).result()
+
+def report(results):
+    columns = ['workload', 'requests', 'seconds', 'requests_per_second', 'p50_ms', 'p99_ms', 'mb_per_second',
+               'errors', 'peak_rss_mb']
+    headers = ['workload', 'requests', 'seconds', 'req/s', 'p50 ms', 'p99 ms', 'MB/s', 'errors', 'peak RSS MB']
+
+    def cell(value):
+        if value is None:
+            return '-'
+        return '%.2f' % value if isinstance(value, float) else str(value)
+
+    rows = [headers] + [[cell(result[column]) for column in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print('  '.join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('workloads', nargs='*', help='any of %s, default: all' % ', '.join(WORKLOADS))
+    parser.add_argument('--networks', type=int, default=2)
+    parser.add_argument('--cameras', type=int, default=5, help='cameras per network')
+    parser.add_argument('--videos', type=int, default=500)
+    parser.add_argument('--video-size', dest='video_size', type=int, default=256*1024)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per request')
+    parser.add_argument('--bandwidth', type=int, default=None, help='bytes per second per response')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0)
+    parser.add_argument('--max-workers', dest='max_workers', type=int, default=8)
+    parser.add_argument('--rate-limit', dest='rate_limit', type=float, default=None, help='requests per second')
+    parser.add_argument('--json', dest='json', type=str, help='file to write the results to')
+    args = parser.parse_args()
+    for name in args.workloads:
+        if name not in WORKLOADS:
+            parser.error('unknown workload ' + name)
+
+    results = []
+    for name in args.workloads or list(WORKLOADS):
+        # every workload gets its own account, as some of them delete events
+        with MockServer(latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                        command_delay=0.2, networks=args.networks, cameras=args.cameras,
+                        videos=args.videos, video_size=args.video_size) as server:
+            results.append(run_isolated(name, server.url, max_workers=args.max_workers,
+                                        rate_limit=args.rate_limit))
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,16 +1,279 @@
 from __future__ import print_function
-import io, json, os, requests, sys, yaml
-from time import sleep
-import dateutil.parser
+import heapq, itertools, os, threading
+from array import array
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict, deque
+from itertools import islice
+from threading import Condition, Event as ThreadEvent, Lock
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from time import monotonic, sleep, time
+
+# requests, dateutil, sqlite3, json, orjson, hashlib, concurrent.futures, numpy and PIL are imported
+# on first use to keep `import blink` cheap, see test_import_time in unittests.py
 
 
 __version__ = '0.3.0'
 
+PRIORITY_CONTROL = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BULK = 2
+
+class BlinkError(Exception):
+    pass
+
+class BlinkHTTPError(BlinkError):
+    '''
+      The server kept answering a request with an error status
+    '''
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        BlinkError.__init__(self, '%s %s for %s' % (response.status_code, response.reason, response.url))
+
 def save_to_file(content, filename):
     f = open(filename, 'wb')
     f.write(content)
     f.close()
 
+def parse_timestamp(value):
+    '''
+      Returns value as a timezone aware datetime, value is a datetime or a timestamp
+      string such as the created_at of an event. Naive values are taken as UTC.
+    '''
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            import dateutil.parser
+            value = dateutil.parser.parse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def file_checksum(filename, chunk_size=1024*1024):
+    '''
+      Returns the sha256 hex digest of the file
+    '''
+    import hashlib
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+###############################################################################
+##  JSON
+###############################################################################
+
+_json_loads = None
+
+def set_json_backend(backend=None):
+    '''
+      Selects the decoder of the responses: 'orjson', 'ujson', 'json' or a loads function
+      taking bytes. None picks the first of orjson, ujson and json that is installed.
+      Returns the loads function in use.
+    '''
+    global _json_loads
+    if callable(backend):
+        _json_loads = backend
+        return _json_loads
+    import importlib
+    for name in [backend] if backend else ['orjson', 'ujson', 'json']:
+        try:
+            _json_loads = importlib.import_module(name).loads
+            return _json_loads
+        except ImportError:
+            if backend:
+                raise
+    return _json_loads
+
+def json_loads(data):
+    '''
+      Decodes JSON bytes or text with the backend of set_json_backend
+    '''
+    return (_json_loads or set_json_backend())(data)
+
+def iter_json_items(chunks, key=None):
+    '''
+      Yields the items of a JSON array as soon as each is decoded from chunks, an iterable
+      of bytes, holding only the undecoded rest of the text in memory.
+      key: the array is the value of this key of a top level object, e.g. 'devices'.
+      Only the array is read, the values of the other keys are skipped.
+    '''
+    import codecs, json
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    state = {'buffer': '', 'pos': 0, 'eof': False}
+
+    def more():
+        for chunk in chunks:
+            text = utf8.decode(chunk)
+            if text:
+                state['buffer'] = state['buffer'][state['pos']:] + text
+                state['pos'] = 0
+                return True
+        state['eof'] = True
+        return False
+
+    def peek():
+        # next non whitespace character, or '' at the end
+        while True:
+            buffer, pos = state['buffer'], state['pos']
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not more():
+                return ''
+
+    def expect(chars):
+        char = peek()
+        if char not in chars:
+            raise ValueError('expected %s at %r' % (' or '.join(chars), state['buffer'][state['pos']:state['pos'] + 20]))
+        state['pos'] += 1
+        return char
+
+    def value():
+        peek()
+        while True:
+            try:
+                item, end = decoder.raw_decode(state['buffer'], state['pos'])
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(state['buffer']) or state['eof']:
+                    state['pos'] = end
+                    return item
+            except ValueError:
+                if state['eof']:
+                    raise
+            more()
+
+    if key is not None:
+        expect('{')
+        if peek() == '}':
+            return
+        while True:
+            name = value()
+            expect(':')
+            if name == key:
+                break
+            value()
+            if expect(',}') == '}':
+                return
+    expect('[')
+    if peek() == ']':
+        return
+    while True:
+        yield value()
+        if expect(',]') == ']':
+            return
+
+class TokenBucket(object):
+    '''
+      Thread safe token bucket refilled with rate tokens per second up to capacity
+      consume() may overdraw the bucket, the caller then sleeps off the debt, so
+      amounts larger than the capacity still pass at the configured rate.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, amount=1):
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            debt = -self._tokens
+        if debt > 0:
+            sleep(debt / self.rate)
+
+    def try_consume(self, amount=1):
+        '''
+          Takes amount tokens if available and returns 0, otherwise returns the seconds
+          until they will be
+        '''
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0
+            return (amount - self._tokens) / self.rate
+
+class RequestScheduler(object):
+    '''
+      Admits requests one at a time in priority order
+      A request waits for a token of the rate limiter (rate per second, bursts up to
+      burst) and for one of max_inflight slots. Waiting requests of a lower priority
+      value go first, so PRIORITY_CONTROL calls overtake queued PRIORITY_BULK traffic.
+      A request admitted here also has to be admitted by the parent scheduler, if any,
+      which lets accounts with their own limits share a global one.
+    '''
+    def __init__(self, rate=None, burst=None, max_inflight=16, parent=None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_inflight = max_inflight
+        self.parent = parent
+        self._inflight = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._cond = Condition()
+
+    def acquire(self, priority=PRIORITY_DEFAULT):
+        with self._cond:
+            ticket = (priority, next(self._order))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                wait = None
+                if self._waiting[0] == ticket and self._inflight < self.max_inflight:
+                    wait = self.bucket.try_consume() if self.bucket is not None else 0
+                    if not wait:
+                        heapq.heappop(self._waiting)
+                        self._inflight += 1
+                        self._cond.notify_all()
+                        break
+                self._cond.wait(wait)
+        if self.parent is not None:
+            try:
+                self.parent.acquire(priority)
+            except BaseException:
+                self._release()
+                raise
+
+    def release(self):
+        if self.parent is not None:
+            self.parent.release()
+        self._release()
+
+    def _release(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+def pooled_session(pool_connections=4, pool_maxsize=10, keep_alive=True):
+    '''
+      Returns a requests.Session keeping up to pool_maxsize connections to each of
+      pool_connections hosts
+    '''
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
 def remove_info(filefrom, fileto):
     fw = open(fileto, "w")
     with open(filefrom) as f:
@@ -33,57 +296,788 @@ def remove_info(filefrom, fileto):
 
     fw.close()
 
-class Network(object):
+def _build_model(cls, data):
+    return cls(**data)
+
+class Model(object):
+    '''
+      Base of the API models, built from the json of a response
+      The known fields of a model are slots, the remaining keys go to a single overflow
+      dict and are still readable (and writable) as attributes.
+    '''
+    __slots__ = ('_extra',)
+    _fields = ()
+
     def __init__(self, **kwargs):
-        for k,v in kwargs.items():
-            setattr(self, k, v)
+        for name in self._fields:
+            object.__setattr__(self, name, kwargs.pop(name, None))
+        # kwargs keeps the table sized for all the keys, the copy is built item by item to fit the rest
+        object.__setattr__(self, '_extra', dict(kwargs.items()) if kwargs else None)
+
+    def __getattr__(self, name):
+        try:
+            extra = object.__getattribute__(self, '_extra')
+        except AttributeError:
+            extra = None
+        if extra and name in extra:
+            return extra[name]
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if self._extra is None:
+                object.__setattr__(self, '_extra', {})
+            self._extra[name] = value
+
+    def __reduce__(self):
+        return (_build_model, (type(self), self.to_dict()))
+
+    def to_dict(self):
+        data = dict((name, getattr(self, name)) for name in self._fields)
+        data.update(self._extra or {})
+        return data
+
+class Network(Model):
+    __slots__ = ('id', 'name', 'onboarded')
+    _fields = __slots__
+
     def __repr__(self):
         return '<Network id=%s name=%s>' % (self.id, repr(self.name))
 
-class Event(object):
-    def __init__(self, **kwargs):
-        for k,v in kwargs.items():
-            setattr(self, k, v)
+class Event(Model):
+    '''
+      created_at is parsed to a datetime on first access, created_at_raw is the
+      timestamp string as sent by the server
+    '''
+    __slots__ = ('id', 'camera_id', 'camera_name', 'network_id', 'network_name', 'address', 'thumbnail',
+                 'length', 'watched', 'partial', 'deleted', 'type', 'updated_at', 'created_at_raw', '_created_at')
+    _fields = ('id', 'camera_id', 'camera_name', 'network_id', 'network_name', 'address', 'thumbnail',
+               'length', 'watched', 'partial', 'deleted', 'type', 'updated_at', 'created_at')
+
+    @property
+    def created_at(self):
+        if self._created_at is None and self.created_at_raw is not None:
+            object.__setattr__(self, '_created_at', parse_timestamp(self.created_at_raw))
+        return self._created_at
+
+    @created_at.setter
+    def created_at(self, value):
+        if isinstance(value, datetime):
+            object.__setattr__(self, 'created_at_raw', value.isoformat())
+            object.__setattr__(self, '_created_at', value)
+        else:
+            object.__setattr__(self, 'created_at_raw', value)
+            object.__setattr__(self, '_created_at', None)
+
+    def to_dict(self):
+        # created_at_raw is read directly, the timestamp stays unparsed
+        data = dict((name, getattr(self, name)) for name in self._fields if name != 'created_at')
+        data['created_at'] = self.created_at_raw
+        data.update(self._extra or {})
+        return data
+
     def __repr__(self):
-        return '<Event id=%s camera=%s at=%s>' % (self.id, repr(self.camera_name), repr(self.created_at))
+        return '<Event id=%s camera=%s at=%s>' % (self.id, repr(self.camera_name), repr(self.created_at_raw))
+
+class Video(Event):
+    __slots__ = ()
 
-class Video(object):
-    def __init__(self, **kwargs):
-        for k,v in kwargs.items():
-            setattr(self, k, v)
     def __repr__(self):
-        return '<Video id=%s camera=%s at=%s>' % (self.id, repr(self.camera_name), repr(self.created_at))
+        return '<Video id=%s camera=%s at=%s>' % (self.id, repr(self.camera_name), repr(self.created_at_raw))
+
+class SyncModule(Model):
+    __slots__ = ('id', 'network_id', 'name', 'serial', 'status', 'onboarded')
+    _fields = __slots__
 
-class SyncModule(object):
-    def __init__(self, **kwargs):
-        for k,v in kwargs.items():
-            setattr(self, k, v)
     def __repr__(self):
-        return '<SyncModule %s>' % repr(self.__dict__)
+        return '<SyncModule %s>' % repr(self.to_dict())
+
+class Camera(Model):
+    __slots__ = ('id', 'camera_id', 'name', 'network_id', 'thumbnail', 'enabled', 'active')
+    _fields = __slots__
 
-class Camera(object):
-    def __init__(self, **kwargs):
-        for k,v in kwargs.items():
-            setattr(self, k, v)
     def __repr__(self):
         return '<Camera id=%s name=%s>' % (self.id, repr(self.name))
 
+class EventBatch(object):
+    '''
+      Columnar view of events for bulk filtering
+      The event ids, camera ids and created_at epoch seconds are kept in typed arrays,
+      a missing camera id is stored as -1.
+    '''
+    def __init__(self, events):
+        self.events = list(events)
+        self.ids = array('q', [event.id for event in self.events])
+        self.camera_ids = array('q', [-1 if event.camera_id is None else event.camera_id for event in self.events])
+        self.timestamps = array('d', [_epoch(event.created_at_raw) for event in self.events])
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __getitem__(self, i):
+        return self.events[i]
+
+    def indices(self, camera_id=None, since=None, until=None):
+        '''
+          Returns the positions of the events matching the camera and the created_at bounds
+        '''
+        since = _epoch(since) if since is not None else float('-inf')
+        until = _epoch(until) if until is not None else float('inf')
+        timestamps = self.timestamps
+        if camera_id is None:
+            return [i for i in range(len(timestamps)) if since <= timestamps[i] <= until]
+        camera_ids = self.camera_ids
+        return [i for i in range(len(timestamps)) if camera_ids[i] == camera_id and since <= timestamps[i] <= until]
+
+    def select(self, camera_id=None, since=None, until=None):
+        '''
+          Returns an EventBatch of the events matching the camera and the created_at bounds
+        '''
+        return EventBatch(self.events[i] for i in self.indices(camera_id, since, until))
+
+def _epoch(value):
+    return parse_timestamp(value).timestamp() if value is not None else float('nan')
+
+###############################################################################
+##  Event Index
+###############################################################################
+
+class EventIndex(object):
+    '''
+      SQLite index of the events known locally, with their download state
+      Every lookup goes through the event id primary key, so it stays cheap
+      however many clips have been archived.
+    '''
+    PENDING = 'pending'
+    DOWNLOADED = 'downloaded'
+    FAILED = 'failed'
+    EVICTED = 'evicted'
+    SKIPPED = 'skipped'
+
+    def __init__(self, path=':memory:'):
+        import sqlite3
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute('''CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY,
+                camera_id INTEGER,
+                camera_name TEXT,
+                network_id INTEGER,
+                created_at TEXT,
+                address TEXT,
+                thumbnail TEXT,
+                state TEXT NOT NULL,
+                size INTEGER,
+                checksum TEXT,
+                path TEXT,
+                network_name TEXT)''')
+            # indexes written before network_name was kept
+            if 'network_name' not in [column[1] for column in self._db.execute('PRAGMA table_info(events)')]:
+                self._db.execute('ALTER TABLE events ADD COLUMN network_name TEXT')
+            self._db.execute('CREATE INDEX IF NOT EXISTS events_state ON events (state, created_at)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS events_camera ON events (camera_id, state, created_at)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS events_path ON events (path)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            # total size of the downloaded clips, kept up to date so quotas need no scan
+            if self._db.execute("SELECT 1 FROM meta WHERE key='stored_bytes'").fetchone() is None:
+                self._db.execute("INSERT INTO meta SELECT 'stored_bytes', COALESCE(SUM(size), 0) FROM events WHERE state=?",
+                                 (self.DOWNLOADED,))
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def __contains__(self, event_id):
+        return self._db.execute('SELECT 1 FROM events WHERE id=?', (event_id,)).fetchone() is not None
+
+    def get(self, event_id):
+        '''
+          Returns the indexed row of the event as a dict, or None
+        '''
+        cursor = self._db.execute('SELECT * FROM events WHERE id=?', (event_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    @property
+    def watermark(self):
+        '''
+          created_at of the newest event seen by the last sync, or None
+        '''
+        row = self._db.execute("SELECT value FROM meta WHERE key='watermark'").fetchone()
+        return row[0] if row else None
+
+    def add(self, events):
+        '''
+          Adds the events not indexed yet as pending
+          Returns the newly added events
+        '''
+        added = []
+        with self._lock, self._db:
+            for event in events:
+                cursor = self._db.execute('INSERT OR IGNORE INTO events (id, camera_id, camera_name, network_id, '
+                                          'network_name, created_at, address, thumbnail, state) '
+                                          'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                          (event.id, event.camera_id, event.camera_name, event.network_id,
+                                           event.network_name, event.created_at_raw, event.address, event.thumbnail,
+                                           self.PENDING))
+                if cursor.rowcount:
+                    added.append(event)
+        return added
+
+    def advance_watermark(self, events):
+        '''
+          Moves the watermark to the newest created_at of events, once they are all indexed
+        '''
+        newest = self.watermark
+        for event in events:
+            if newest is None or event.created_at > parse_timestamp(newest):
+                newest = event.created_at_raw
+        if newest is not None:
+            with self._lock, self._db:
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('watermark', ?)", (newest,))
+
+    def pending(self, limit=-1):
+        '''
+          Returns the rows of the events still to download, oldest first
+        '''
+        cursor = self._db.execute('SELECT * FROM events WHERE state IN (?, ?) ORDER BY created_at LIMIT ?',
+                                  (self.PENDING, self.FAILED, limit))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    @property
+    def stored_bytes(self):
+        '''
+          Total size of the downloaded clips
+        '''
+        return int(self._db.execute("SELECT value FROM meta WHERE key='stored_bytes'").fetchone()[0])
+
+    def _set_state(self, event_id, state, size=None, checksum=None, path=None):
+        with self._lock, self._db:
+            row = self._db.execute('SELECT state, size FROM events WHERE id=?', (event_id,)).fetchone()
+            if row is None:
+                return
+            delta = ((size or 0) if state == self.DOWNLOADED else 0) - ((row[1] or 0) if row[0] == self.DOWNLOADED else 0)
+            self._db.execute('UPDATE events SET state=?, size=?, checksum=?, path=? WHERE id=?',
+                             (state, size, checksum, path, event_id))
+            if delta:
+                self._db.execute("UPDATE meta SET value=value+? WHERE key='stored_bytes'", (delta,))
+
+    def mark_downloaded(self, event_id, size, checksum=None, path=None):
+        self._set_state(event_id, self.DOWNLOADED, size, checksum, path)
+
+    def mark_failed(self, event_id):
+        with self._lock, self._db:
+            self._db.execute('UPDATE events SET state=? WHERE id=? AND state NOT IN (?, ?, ?)',
+                             (self.FAILED, event_id, self.DOWNLOADED, self.EVICTED, self.SKIPPED))
+
+    def mark_evicted(self, event_id):
+        '''
+          The clip was removed locally, it is not downloaded again
+        '''
+        self._set_state(event_id, self.EVICTED)
+
+    def mark_skipped(self, event_id):
+        '''
+          The clip was not downloaded as its scene did not change, it is not tried again
+        '''
+        self._set_state(event_id, self.SKIPPED)
+
+    def oldest(self, limit=100, camera_id=None, before=None):
+        '''
+          Returns the rows of the downloaded clips, oldest first
+          camera_id: only the clips of this camera
+          before: only the clips created before this created_at string
+        '''
+        query = 'SELECT * FROM events WHERE state=?'
+        args = [self.DOWNLOADED]
+        if camera_id is not None:
+            query += ' AND camera_id=?'
+            args.append(camera_id)
+        if before is not None:
+            query += ' AND created_at<?'
+            args.append(before)
+        cursor = self._db.execute(query + ' ORDER BY created_at LIMIT ?', args + [limit])
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def path_shared(self, event_id, path):
+        '''
+          Whether another downloaded clip is stored at path, e.g. by a ContentAddressedSink
+        '''
+        return self._db.execute('SELECT 1 FROM events WHERE path=? AND state=? AND id!=?',
+                                (path, self.DOWNLOADED, event_id)).fetchone() is not None
+
+    def in_archive(self, archive):
+        '''
+          Returns the rows of the downloaded clips stored inside archive, e.g. by a RollupSink
+        '''
+        # '0' follows '/', so the range holds the paths below archive/ and uses events_path
+        cursor = self._db.execute('SELECT * FROM events WHERE path>=? AND path<? AND state=?',
+                                  (archive + '/', archive + '0', self.DOWNLOADED))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+###############################################################################
+##  Instrumentation
+###############################################################################
+
+def endpoint_template(path):
+    '''
+      Returns path with every segment holding a number replaced by {id}
+      e.g. network/{id}/camera/{id}/signals or api/v2/video/{id}.mp4
+    '''
+    segments = []
+    for segment in path.strip('/').split('/'):
+        root, ext = os.path.splitext(segment)
+        if any(c.isdigit() for c in root) and not (root[:1] == 'v' and root[1:].isdigit()):
+            segment = '{id}' + ext
+        segments.append(segment)
+    return '/'.join(segments)
+
+class RequestInfo(object):
+    '''
+      Passed to the on_request_start and on_request_end hooks of Blink
+      duration, status, bytes, retries and error are set when the request ended,
+      bytes is the Content-Length for streamed responses.
+    '''
+    __slots__ = ('method', 'path', 'endpoint', 'priority', 'started', 'duration', 'status', 'bytes', 'retries', 'error')
+
+    def __init__(self, method, path, priority):
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint_template(path)
+        self.priority = priority
+        self.started = monotonic()
+        self.duration = None
+        self.status = None
+        self.bytes = None
+        self.retries = 0
+        self.error = None
+
+    def __repr__(self):
+        return '<RequestInfo %s %s status=%s duration=%s>' % (self.method, self.endpoint, self.status, self.duration)
+
+class MetricsCollector(object):
+    '''
+      In-memory latency histograms with byte, status, retry and error counts per endpoint
+
+        metrics = MetricsCollector().attach(b)
+        print(metrics.to_prometheus())
+    '''
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._endpoints = {}
+        self._lock = Lock()
+
+    def attach(self, blink):
+        blink.on_request_end.append(self.record)
+        return self
+
+    def record(self, info):
+        key = (info.method, info.endpoint)
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0,
+                                                'bytes': 0, 'retries': 0, 'errors': 0, 'statuses': {}}
+            i = 0
+            while i < len(self.buckets) and info.duration > self.buckets[i]:
+                i += 1
+            stats['counts'][i] += 1
+            stats['sum'] += info.duration
+            stats['count'] += 1
+            stats['bytes'] += info.bytes or 0
+            stats['retries'] += info.retries
+            if info.error is not None:
+                stats['errors'] += 1
+            stats['statuses'][info.status] = stats['statuses'].get(info.status, 0) + 1
+
+    def endpoints(self):
+        '''
+          Returns the per endpoint statistics keyed by (method, endpoint template)
+        '''
+        with self._lock:
+            return dict((key, dict(stats, counts=list(stats['counts']), statuses=dict(stats['statuses'])))
+                        for key, stats in self._endpoints.items())
+
+    def quantile(self, method, endpoint, q):
+        '''
+          Upper bound of the bucket holding the q quantile of the latency, inf when above all buckets
+        '''
+        stats = self.endpoints().get((method, endpoint))
+        if not stats or not stats['count']:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), stats['counts']):
+            seen += count
+            if seen >= q * stats['count']:
+                return bound
+
+    def to_prometheus(self, prefix='blink'):
+        '''
+          Returns the metrics in the Prometheus text exposition format
+        '''
+        def labels(method, endpoint, **extra):
+            pairs = [('method', method), ('endpoint', endpoint)] + sorted(extra.items())
+            return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                                     for k, v in pairs)
+
+        endpoints = sorted(self.endpoints().items())
+        lines = ['# HELP %s_request_duration_seconds Duration of the requests including retries' % prefix,
+                 '# TYPE %s_request_duration_seconds histogram' % prefix]
+        for (method, endpoint), stats in endpoints:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), stats['counts']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_request_duration_seconds_bucket%s %d' % (prefix, labels(method, endpoint, le=le), cumulative))
+            lines.append('%s_request_duration_seconds_sum%s %r' % (prefix, labels(method, endpoint), stats['sum']))
+            lines.append('%s_request_duration_seconds_count%s %d' % (prefix, labels(method, endpoint), stats['count']))
+        for name, key, help in [('response_bytes_total', 'bytes', 'Bytes of the response bodies'),
+                                ('request_retries_total', 'retries', 'Retries after 429 or 5xx answers'),
+                                ('request_errors_total', 'errors', 'Requests that raised an error')]:
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s counter' % (prefix, name))
+            for (method, endpoint), stats in endpoints:
+                lines.append('%s_%s%s %d' % (prefix, name, labels(method, endpoint), stats[key]))
+        lines.append('# HELP %s_responses_total Responses by status code' % prefix)
+        lines.append('# TYPE %s_responses_total counter' % prefix)
+        for (method, endpoint), stats in endpoints:
+            for status, count in sorted(stats['statuses'].items(), key=lambda item: str(item[0])):
+                lines.append('%s_responses_total%s %d' % (prefix, labels(method, endpoint, status=status), count))
+        return '\n'.join(lines) + '\n'
+
+###############################################################################
+##  Session Cache
+###############################################################################
+
+class SessionCache(object):
+    '''
+      JSON file keeping the auth token, region and networks of logged in accounts
+      The file is only readable by its owner and holds no passwords. Entries expire
+      after ttl seconds.
+    '''
+    def __init__(self, path, ttl=12*3600):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self._lock = Lock()
+
+    def _read(self):
+        import json
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        import json
+        part = self.path + '.part'
+        fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(part, self.path)
+
+    def load(self, key):
+        '''
+          Returns the cached login response of key, or None when missing or expired
+        '''
+        entry = self._read().get(key)
+        if entry is None or entry['expires'] <= time():
+            return None
+        return entry['login']
+
+    def save(self, key, login):
+        with self._lock:
+            entries = self._read()
+            now = time()
+            entries = dict((k, v) for k, v in entries.items() if v['expires'] > now)
+            entries[key] = {'expires': now + self.ttl, 'login': login}
+            self._write(entries)
+
+    def discard(self, key):
+        with self._lock:
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
+
+###############################################################################
+##  Thumbnail Cache
+###############################################################################
+
+class ThumbnailCache(object):
+    '''
+      Size bounded on-disk cache of thumbnails keyed by their path
+      Images are stored content-addressed as directory/<sha1>.jpg, so identical
+      thumbnails share one file, and an index maps each path to its image, ETag and
+      Last-Modified for conditional requests. The max_memory most recent bytes of
+      images are also kept in memory. When the images on disk exceed max_bytes the
+      least recently used paths are evicted.
+
+      max_age: seconds an image is served without asking the server again. Blink
+      thumbnail paths change whenever the camera takes a new one, so a long max_age
+      is safe for them; 0 revalidates on every request.
+      flush_interval: seconds between writes of the index, which is also written by
+      close(). Images stored after the last write are downloaded again next time.
+    '''
+    def __init__(self, directory, max_bytes=256*1024*1024, max_memory=16*1024*1024, max_age=0,
+                 flush_interval=10):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_memory = max_memory
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._index_path = os.path.join(directory, 'index.json')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._entries = OrderedDict(self._load_index())
+        # number of paths referring to each image file, and its size
+        self._refs = {}
+        self._disk_bytes = 0
+        for entry in self._entries.values():
+            self._add_ref(entry)
+        self._remove_unindexed()
+        self._evict()
+        self._changes = 0
+        self._flushed = time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._changes:
+            self.flush()
+
+    @property
+    def hit_ratio(self):
+        '''
+          Share of the lookups answered without downloading the image again
+        '''
+        total = self.hits + self.revalidated + self.misses
+        return float(self.hits + self.revalidated) / total if total else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses,
+                'hit_ratio': self.hit_ratio, 'entries': len(self._entries), 'disk_bytes': self._disk_bytes,
+                'memory_bytes': self._memory_bytes}
+
+    def _load_index(self):
+        import json
+        try:
+            with open(self._index_path) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return []
+        return [(entry['path'], entry) for entry in entries
+                if os.path.exists(self._blob_path(entry['digest']))]
+
+    def _remove_unindexed(self):
+        '''
+          Deletes the images and partial files left behind by a run that stopped before
+          writing its index
+        '''
+        for name in os.listdir(self.directory):
+            if name.endswith('.part') or (name.endswith('.jpg') and name[:-4] not in self._refs):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def flush(self):
+        '''
+          Writes the index to disk, done by store() at most every flush_interval seconds
+        '''
+        import json
+        with self._flush_lock:
+            with self._lock:
+                entries = [dict(entry) for entry in self._entries.values()]
+                self._changes = 0
+                self._flushed = time()
+            temp = '%s.%d.part' % (self._index_path, next(_temp_ids))
+            with open(temp, 'w') as f:
+                json.dump(entries, f)
+            os.replace(temp, self._index_path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, digest + '.jpg')
+
+    def _add_ref(self, entry):
+        digest = entry['digest']
+        if digest not in self._refs:
+            self._disk_bytes += entry['size']
+        self._refs[digest] = self._refs.get(digest, 0) + 1
+
+    def fresh(self, path):
+        '''
+          Returns the cached image of path if it is younger than max_age, else None
+        '''
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or time() - entry['validated'] >= self.max_age:
+                return None
+        content = self._read(path, entry)
+        if content is not None:
+            self.hits += 1
+        return content
+
+    def conditional_headers(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def not_modified(self, path):
+        '''
+          The server confirmed the cached image of path, returns it
+        '''
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                entry['validated'] = time()
+        content = self._read(path, entry) if entry is not None else None
+        if content is not None:
+            self.revalidated += 1
+        return content
+
+    def _read(self, path, entry):
+        with self._lock:
+            content = self._memory.get(path)
+            if content is not None:
+                self._memory.move_to_end(path)
+                self._entries.move_to_end(path)
+                return content
+        try:
+            with open(self._blob_path(entry['digest']), 'rb') as f:
+                content = f.read()
+        except (IOError, OSError):
+            with self._lock:
+                if self._entries.get(path) is entry:
+                    self._release(self._entries.pop(path))
+            return None
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+            self._remember(path, content)
+        return content
+
+    def _remember(self, path, content):
+        if len(content) > self.max_memory:
+            return
+        previous = self._memory.pop(path, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[path] = content
+        self._memory_bytes += len(content)
+        while self._memory_bytes > self.max_memory:
+            evicted_path, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def store(self, path, content, etag=None, last_modified=None):
+        from hashlib import sha1
+        digest = sha1(content).hexdigest()
+        blob = self._blob_path(digest)
+        entry = {'path': path, 'digest': digest, 'size': len(content), 'etag': etag,
+                 'last_modified': last_modified, 'validated': time()}
+        with self._lock:
+            # the reference keeps an eviction from deleting the image while it is written
+            write = digest not in self._refs
+            self._add_ref(entry)
+        if write:
+            temp = '%s.%d.part' % (blob, next(_temp_ids))
+            try:
+                with open(temp, 'wb') as f:
+                    f.write(content)
+                os.replace(temp, blob)
+            except (IOError, OSError):
+                with self._lock:
+                    self._release(entry)
+                raise
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            self._entries[path] = entry
+            if previous is not None:
+                self._release(previous)
+            self._remember(path, content)
+            self.misses += 1
+            self._evict()
+            self._changes += 1
+            due = time() - self._flushed >= self.flush_interval
+        if due:
+            self.flush()
+
+    def _release(self, entry):
+        '''
+          Deletes the image file once no path refers to it anymore
+        '''
+        digest = entry['digest']
+        self._refs[digest] -= 1
+        if self._refs[digest] > 0:
+            return
+        del self._refs[digest]
+        self._disk_bytes -= entry['size']
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._disk_bytes > self.max_bytes and len(self._entries) > 1:
+            path, entry = self._entries.popitem(last=False)
+            content = self._memory.pop(path, None)
+            if content is not None:
+                self._memory_bytes -= len(content)
+            self._release(entry)
+
 ###############################################################################
 ##  Blink API
 ###############################################################################
 
-class Blink(object):
+class BlinkBase(object):
+    '''
+      State and request construction shared by the sync and the asyncio clients
+    '''
 
-    def __init__(self, email, password, server='immedia-semi.com'):
+    def __init__(self, email, password, server='immedia-semi.com', timeout=30, max_workers=8, base_url=None):
         self._authtoken = None
         self._email = email
         self._password = password
         self._server = server
+        self._base_url = base_url.rstrip('/') if base_url else None
         self._region = 'prod'
+        self._timeout = timeout
+        self._max_workers = max_workers
+        self.sweep_errors = []
 
-###############################################################################
-##  Property
-###############################################################################
     @property
     def connected(self):
         return self._authtoken is not None
@@ -92,31 +1086,15 @@ class Blink(object):
     def _auth_headers(self):
         return {'TOKEN_AUTH': self._authtoken['authtoken']}
 
-###############################################################################
-##  Common
-###############################################################################
-    def _connect_if_needed(self):
-        if not self._authtoken: self.login()
-        if not self.connected: raise Exception('Unable to connect.')
-
     def _path(self, path):
+        if self._base_url is not None:
+            return '%s/%s' % (self._base_url, path.lstrip('/'))
         return 'https://rest.%s.%s/%s' % (self._region, self._server, path.lstrip('/'))
 
-    def get_event_name_v2(self, event):
-        files = event.address.split('/')
-        return event.camera_name + "_" + files[len(files)-1]
-
-    def get_thumbnail_name_event(self, event, postfix=""):
-        return self.get_event_name_v2(event) + postfix + ".jpg"
-
-    def get_thumbnail_name_device(self, device, postfix=""):
-        files = device['thumbnail'].split('/')
-        return files[len(files)-1] + postfix + ".jpg"
-
-###############################################################################
-##  Highlighted Client APIs
-###############################################################################
-    def login(self):
+    def _login_request(self):
+        '''
+          Returns the headers and the json body of the login request
+        '''
         headers = {
             'Content-Type': 'application/json',
             'Host': "prod." + self._server,
@@ -126,10 +1104,9 @@ class Blink(object):
             'password': self._password,
             'client_specifier': 'iPhone 9.2 | 2.2 | 222',
         }
-        resp = requests.post(self._path('login'), json=data, headers=headers)
-        if resp.status_code!=200:
-            raise Exception(resp.json()['message'])
-        raw = resp.json()
+        return headers, data
+
+    def _load_login(self, raw):
         self._networks_by_id = raw['networks']
         self.networks = []
         for network_id, network in self._networks_by_id.items():
@@ -138,13 +1115,430 @@ class Blink(object):
             network = Network(**network)
             self.networks.append(network)
 
-        (self._region, value) = raw['region'].items()[0]
+        (self._region, value) = list(raw['region'].items())[0]
         self._authtoken = raw['authtoken']
 
+    def _filter_onboarded(self, resp):
+        return [network for network in resp['networks'] if resp['summary'][str(network['id'])]['onboarded']]
+
+    def _sweep_error_info(self, network, camera, error):
+        return {'network_id': network['id'], 'camera_id': camera['camera_id'], 'error': str(error)}
+
+    def get_event_name_v2(self, event):
+        files = event.address.split('/')
+        return event.camera_name + "_" + files[len(files)-1]
+
+    def get_thumbnail_name_event(self, event, postfix=""):
+        return self.get_event_name_v2(event) + postfix + ".jpg"
+
+    def get_thumbnail_name_device(self, device, postfix=""):
+        files = device['thumbnail'].split('/')
+        return files[len(files)-1] + postfix + ".jpg"
+
+
+class DeleteStats(object):
+    def __init__(self):
+        self.deleted = 0
+        self.failed = 0
+        self.outcomes = {}
+        self.started = monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        '''
+          clips handled per second so far
+        '''
+        return (self.deleted + self.failed) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return '<DeleteStats deleted=%d failed=%d %.1f/s>' % (self.deleted, self.failed, self.throughput)
+
+
+class _Flight(object):
+    '''
+      One GET shared by concurrent callers, see Blink._shared_get
+    '''
+    __slots__ = ('done', 'result', 'error', 'expires')
+
+    def __init__(self):
+        self.done = ThreadEvent()
+        self.result = None
+        self.error = None
+        self.expires = 0
+
+
+class Blink(BlinkBase):
+
+    def __init__(self, email, password, server='immedia-semi.com',
+                 pool_connections=4, pool_maxsize=10, timeout=30, keep_alive=True,
+                 max_workers=8, topology_ttl=300, rate_limit=10, burst=20, max_inflight=None,
+                 retries=3, max_backoff=30, session_cache=None, thumbnail_cache=None, coalesce_ttl=0,
+                 session=None, scheduler=None, base_url=None):
+        '''
+          pool_connections: number of per-host connection pools to keep
+          pool_maxsize: maximum number of pooled connections per host
+          timeout: seconds to wait for the server (connect and read)
+          keep_alive: reuse connections between requests
+          max_workers: maximum number of concurrent requests of the multi-camera sweeps
+          topology_ttl: seconds the networks and camera lists are cached, 0 disables the cache
+          rate_limit: requests per second sent at most, in bursts of up to burst, None for unlimited
+          max_inflight: requests waiting for response headers at once, defaults to pool_maxsize
+          retries: how often a request answered with 429 or 5xx is retried
+          max_backoff: upper bound in seconds of the delay between retries
+          session_cache: SessionCache or path of its file, to reuse the login of a previous process
+          thumbnail_cache: ThumbnailCache or its directory, used by the download_thumbnail_*_v2 functions
+          coalesce_ttl: seconds the result of a shared read (see _shared_get) is reused after it arrived
+          session: requests.Session shared with other clients, see pooled_session; the pool options are then ignored
+          scheduler: RequestScheduler shared with other clients; rate_limit, burst and max_inflight are then ignored
+          base_url: send all requests to this URL instead of the region host, e.g. a mockserver.MockServer
+        '''
+        BlinkBase.__init__(self, email, password, server, timeout, max_workers, base_url)
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._keep_alive = keep_alive
+        self._session = session
+        self._shared_session = session is not None
+        self._topology_ttl = topology_ttl
+        self._topology = {}
+        self._topology_lock = Lock()
+        self.topology_hits = 0
+        self.topology_misses = 0
+        self.scheduler = scheduler or RequestScheduler(rate_limit, burst, max_inflight or pool_maxsize)
+        self._retries = retries
+        self._max_backoff = max_backoff
+        if session_cache is not None and not isinstance(session_cache, SessionCache):
+            session_cache = SessionCache(session_cache)
+        self.session_cache = session_cache
+        self._login_lock = Lock()
+        self.on_request_start = []
+        self.on_request_end = []
+        if thumbnail_cache is not None and not isinstance(thumbnail_cache, ThumbnailCache):
+            thumbnail_cache = ThumbnailCache(thumbnail_cache)
+        self.thumbnail_cache = thumbnail_cache
+        self._coalesce_ttl = coalesce_ttl
+        self._flights = {}
+        self._flights_lock = Lock()
+        self.coalesced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+###############################################################################
+##  Property
+###############################################################################
+    @property
+    def session(self):
+        '''
+          The pooled keep-alive session all requests go through
+        '''
+        if self._session is None:
+            self._session = self._new_session()
+        return self._session
+
+###############################################################################
+##  Common
+###############################################################################
+    def _connect_if_needed(self):
+        if not self._authtoken:
+            with self._login_lock:
+                # concurrent first calls wait for the login of the first one
+                if not self._authtoken:
+                    self.connect()
+        if not self.connected: raise Exception('Unable to connect.')
+
+    @property
+    def _session_key(self):
+        return '%s@%s' % (self._email, self._base_url or self._server)
+
+    def connect(self):
+        '''
+          Reuses the login kept in the session cache, or logs in
+        '''
+        raw = self.session_cache.load(self._session_key) if self.session_cache is not None else None
+        if raw is None:
+            self.login()
+            return
+        self._load_login(raw)
+        self._use_token()
+        self.invalidate_topology()
+
+    def _new_session(self):
+        session = pooled_session(self._pool_connections, self._pool_maxsize, self._keep_alive)
+        if self._authtoken:
+            session.headers.update(self._auth_headers)
+        return session
+
+    def _use_token(self):
+        '''
+          Sends the token of the current login from now on
+          The pool is kept, even when the region host changed, as other threads may be using
+          it. A shared session carries no auth headers.
+        '''
+        if self._session is not None and not self._shared_session:
+            self._session.headers.update(self._auth_headers)
+
+    def close(self):
+        if self.thumbnail_cache is not None:
+            self.thumbnail_cache.close()
+        # a shared session belongs to whoever passed it in, e.g. BlinkFleet
+        if self._session is not None and not self._shared_session:
+            self._session.close()
+            self._session = None
+
+    def _request(self, method, path, priority=PRIORITY_DEFAULT, idempotent=None, **kwargs):
+        '''
+          Sends the request through the scheduler, retrying 429 answers, and 5xx answers
+          of idempotent requests: by default every method but POST, as a POST may have been
+          carried out before the server failed, e.g. a camera command that would run twice.
+          Raises BlinkHTTPError when they persist after all retries.
+          The on_request_start and on_request_end hooks get a RequestInfo.
+        '''
+        info = RequestInfo(method, path, priority)
+        for hook in self.on_request_start:
+            hook(info)
+        try:
+            resp = self._send(info, method != 'POST' if idempotent is None else idempotent, **kwargs)
+            info.status = resp.status_code
+            if kwargs.get('stream'):
+                length = resp.headers.get('Content-Length')
+                info.bytes = int(length) if length and length.isdigit() else None
+            else:
+                info.bytes = len(resp.content)
+            return resp
+        except Exception as e:
+            info.error = e
+            if isinstance(e, BlinkHTTPError):
+                info.status = e.status_code
+            raise
+        finally:
+            info.duration = monotonic() - info.started
+            for hook in self.on_request_end:
+                hook(info)
+
+    def _send(self, info, idempotent, **kwargs):
+        method, path, priority = info.method, info.path, info.priority
+        kwargs.setdefault('timeout', self._timeout)
+        headers = kwargs.get('headers')
+        attempt = 0
+        reauthenticated = path == 'login'
+        while True:
+            authtoken = self._authtoken
+            if self._shared_session and authtoken is not None:
+                # the shared session serves many accounts, the token goes with every request
+                kwargs['headers'] = dict(self._auth_headers)
+                kwargs['headers'].update(headers or {})
+            self.scheduler.acquire(priority)
+            try:
+                resp = self.session.request(method, self._path(path), **kwargs)
+            finally:
+                self.scheduler.release()
+            if resp.status_code == 401 and not reauthenticated and authtoken is not None:
+                # the token expired or was revoked, log in again once and repeat the request
+                resp.close()
+                self._relogin(authtoken)
+                reauthenticated = True
+                continue
+            if resp.status_code != 429 and resp.status_code < 500:
+                return resp
+            if attempt >= self._retries or (resp.status_code != 429 and not idempotent):
+                raise BlinkHTTPError(resp)
+            delay = self._retry_delay(resp, attempt)
+            resp.close()
+            sleep(delay)
+            attempt += 1
+            info.retries = attempt
+
+    def _relogin(self, authtoken):
+        with self._login_lock:
+            # another thread may have logged in while this request was failing
+            if self._authtoken is authtoken:
+                if self.session_cache is not None:
+                    self.session_cache.discard(self._session_key)
+                self.login()
+
+    def _retry_delay(self, resp, attempt):
+        '''
+          Seconds to wait before retrying: the Retry-After of the server if given,
+          otherwise a jittered exponential backoff
+        '''
+        import random
+        retry_after = resp.headers.get('Retry-After') if resp is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                from email.utils import parsedate_to_datetime
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = 0
+            return min(max(delay, 0), self._max_backoff) + random.uniform(0, 0.1)
+        return random.uniform(0, min(self._max_backoff, 0.5 * 2 ** attempt))
+
+    def _get(self, path, **kwargs):
+        return self._request('GET', path, **kwargs)
+
+    def _get_json(self, path, **kwargs):
+        return json_loads(self._get(path, **kwargs).content)
+
+    def _post_json(self, path, **kwargs):
+        return json_loads(self._post(path, **kwargs).content)
+
+    def _stream_json(self, path, key=None, priority=PRIORITY_DEFAULT, chunk_size=64*1024):
+        '''
+          Yields the items of the JSON array at path (or of its key) while they arrive,
+          see iter_json_items
+        '''
+        resp = self._get(path, stream=True, priority=priority)
+        try:
+            if resp.status_code != 200:
+                raise BlinkHTTPError(resp)
+            for item in iter_json_items(resp.iter_content(chunk_size), key):
+                yield item
+        finally:
+            resp.close()
+
+    def _post(self, path, **kwargs):
+        # a command may change what the reads return, drop their reusable results
+        if self._coalesce_ttl:
+            with self._flights_lock:
+                self._flights = dict((p, f) for p, f in self._flights.items() if not f.done.is_set())
+        return self._request('POST', path, **kwargs)
+
+    def _shared_get(self, path):
+        '''
+          GETs path and returns the parsed JSON
+          Concurrent callers of the same path share one request and its result, which is
+          reused for coalesce_ttl seconds after it arrived. The result is shared, do not modify it.
+        '''
+        with self._flights_lock:
+            flight = self._flights.get(path)
+            leader = flight is None or (flight.done.is_set() and flight.expires <= monotonic())
+            if leader:
+                flight = _Flight()
+                self._flights[path] = flight
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                flight.result = self._get_json(path)
+            except Exception as e:
+                flight.error = e
+            # failures are only shared with the callers already waiting, never reused
+            if flight.error is None:
+                flight.expires = monotonic() + self._coalesce_ttl
+            flight.done.set()
+            if not self._coalesce_ttl or flight.error is not None:
+                with self._flights_lock:
+                    if self._flights.get(path) is flight:
+                        del self._flights[path]
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _fan_out(self, func, items):
+        '''
+          Calls func(item) for every item on a pool of at most max_workers threads
+          Returns (item, result, error) tuples in the order of items
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        items = list(items)
+        if not items:
+            return []
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, min(self._max_workers, len(items)))) as pool:
+            futures = [pool.submit(func, item) for item in items]
+            for item, future in zip(items, futures):
+                try:
+                    results.append((item, future.result(), None))
+                except Exception as e:
+                    results.append((item, None, e))
+        return results
+
+    def _cached_topology(self, key, fetch):
+        '''
+          Returns the cached topology entry for key, calling fetch() when it is missing or expired
+        '''
+        with self._topology_lock:
+            entry = self._topology.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self.topology_hits += 1
+                return entry[1]
+            self.topology_misses += 1
+        value = fetch()
+        if self._topology_ttl:
+            with self._topology_lock:
+                self._topology[key] = (monotonic() + self._topology_ttl, value)
+        return value
+
+    def invalidate_topology(self):
+        '''
+          Forget the cached networks and camera lists, the next call fetches them again
+        '''
+        with self._topology_lock:
+            self._topology = {}
+
+    def _onboarded_networks(self):
+        return self._cached_topology('networks', lambda: self._filter_onboarded(self._shared_get("networks")))
+
+    def _network_cameras(self, network_id):
+        camurl = "network/"+str(network_id)+"/cameras"
+        return self._cached_topology(camurl, lambda: self._shared_get(camurl)['devicestatus'])
+
+    def _all_cameras(self):
+        '''
+          Returns (network, camera) pairs for every camera of the onboarded networks
+          Networks whose camera list cannot be fetched are recorded in sweep_errors
+        '''
+        pairs = []
+        for network, cameras, error in self._fan_out(lambda network: self._network_cameras(network['id']), self._onboarded_networks()):
+            if error is not None:
+                self.sweep_errors.append({'network_id': network['id'], 'camera_id': None, 'error': error})
+                continue
+            pairs.extend((network, camera) for camera in cameras)
+        return pairs
+
+    def _sweep_cameras(self, func):
+        '''
+          Calls func(network, camera) for every camera concurrently
+          Returns (network, camera, result, error) tuples in camera order, a failing
+          camera does not abort the sweep but is recorded in sweep_errors
+        '''
+        self.sweep_errors = []
+        results = []
+        for (network, camera), result, error in self._fan_out(lambda pair: func(*pair), self._all_cameras()):
+            if error is not None:
+                self.sweep_errors.append({'network_id': network['id'], 'camera_id': camera['camera_id'], 'error': error})
+            results.append((network, camera, result, error))
+        return results
+
+###############################################################################
+##  Highlighted Client APIs
+###############################################################################
+    def login(self):
+        headers, data = self._login_request()
+        resp = self._post('login', json=data, headers=headers, priority=PRIORITY_CONTROL, idempotent=True)
+        if resp.status_code!=200:
+            raise Exception(json_loads(resp.content)['message'])
+        raw = json_loads(resp.content)
+        self._load_login(raw)
+        self._use_token()
+        self.invalidate_topology()
+        if self.session_cache is not None:
+            self.session_cache.save(self._session_key, dict((k, raw[k]) for k in ('networks', 'region', 'authtoken')))
+
     def cameras(self, network, type='motion'):
         self._connect_if_needed()
-        resp = requests.get(self._path('network/%s/cameras' % network.id), headers=self._auth_headers)
-        cameras = resp.json()['devicestatus']
+        cameras = self._network_cameras(network.id)
         cameras = [Camera(**camera) for camera in cameras]
         return cameras
 
@@ -153,16 +1547,14 @@ class Blink(object):
         Return information displayed on the home screen of the mobile client
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path('homescreen'), headers=self._auth_headers)
-        return resp.json()
+        return self._shared_get('homescreen')
 
     def download_thumbnail_event_v2(self, event):
         '''
           returns the jpg data as a file-like object
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path(event.thumbnail+".jpg"), headers=self._auth_headers)
-        return resp.content
+        return self._get_thumbnail(event.thumbnail+".jpg")
 
     def download_thumbnail_home_v2(self, device):
         '''
@@ -170,119 +1562,327 @@ class Blink(object):
         '''
         self._connect_if_needed()
         filename = device['thumbnail']+".jpg"
-        resp = requests.get(self._path(filename), headers=self._auth_headers)
-        return resp.content, self.get_thumbnail_name_device(device)
+        return self._get_thumbnail(filename), self.get_thumbnail_name_device(device)
+
+    def thumbnail_changes(self, detector):
+        '''
+          Downloads the latest thumbnail of every camera and scores it with detector
+          against the one of the previous call, see ChangeDetector
+          Returns a dict of device id -> score
+        '''
+        self._connect_if_needed()
+        devices = [device for device in self.homescreen()['devices'] if device.get('device_type') == 'camera']
+        results = self._fan_out(lambda device: self._get_thumbnail(device['thumbnail']+".jpg"), devices)
+        return detector.update(dict((device['device_id'], content) for device, content, error in results
+                                    if error is None))
+
+    def _get_thumbnail(self, path):
+        '''
+          Returns the image at path, through the thumbnail cache if there is one
+        '''
+        cache = self.thumbnail_cache
+        if cache is None:
+            return self._get(path, priority=PRIORITY_BULK).content
+        content = cache.fresh(path)
+        if content is not None:
+            return content
+        resp = self._get(path, headers=cache.conditional_headers(path), priority=PRIORITY_BULK)
+        if resp.status_code == 304:
+            content = cache.not_modified(path)
+            if content is not None:
+                return content
+            resp = self._get(path, priority=PRIORITY_BULK)
+        if resp.status_code == 200:
+            cache.store(path, resp.content, resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        return resp.content
 
     def eventsv2(self, pagenumber = 0):
         self._connect_if_needed()
-        resp = requests.get(self._path('api/v2/videos/page/'+str(pagenumber)), headers=self._auth_headers)
-        events = resp.json()
+        events = self._events_page(pagenumber)
         events = [Event(**event) for event in events]
         return events
 
+    def iter_eventsv2(self, pagenumber = 0):
+        '''
+          Yields the events of a page while the response is still arriving, instead of
+          holding the whole text and the decoded page in memory
+        '''
+        self._connect_if_needed()
+        for event in self._stream_json('api/v2/videos/page/'+str(pagenumber)):
+            yield Event(**event)
+
+    def iter_homescreen_devices(self):
+        '''
+          Yields the devices of the home screen while the response is still arriving
+        '''
+        self._connect_if_needed()
+        for device in self._stream_json('homescreen', 'devices'):
+            yield device
+
+    def _events_page(self, pagenumber):
+        return self._shared_get('api/v2/videos/page/'+str(pagenumber))
+
     def get_video_count(self):
         self._connect_if_needed()
-        resp = requests.get(self._path('api/v2/videos/count'), headers=self._auth_headers)
-        return resp.json()['count']
+        return self._shared_get('api/v2/videos/count')['count']
 
     def download_video_v2(self, event):
         '''
           returns the mp4 data as a file-like object
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path(event.address), headers=self._auth_headers)
+        resp = self._get(event.address, priority=PRIORITY_BULK)
         return resp.content
 
+    def download_video_v2_to_file(self, event, filename=None):
+        '''
+          streams the mp4 to filename (default get_event_name_v2) without holding it in memory
+          returns the filename and the number of bytes
+        '''
+        return self.download_to_file(event.address, filename or self.get_event_name_v2(event))
+
+    def download_thumbnail_event_v2_to_file(self, event, filename=None):
+        '''
+          streams the jpg to filename (default get_thumbnail_name_event)
+          returns the filename and the number of bytes
+        '''
+        return self.download_to_file(event.thumbnail+".jpg", filename or self.get_thumbnail_name_event(event))
+
+    def download_thumbnail_home_v2_to_file(self, device, filename=None):
+        '''
+          streams the jpg to filename (default get_thumbnail_name_device)
+          returns the filename and the number of bytes
+        '''
+        return self.download_to_file(device['thumbnail']+".jpg", filename or self.get_thumbnail_name_device(device))
+
+    def download_to_file(self, path, filename, chunk_size=64*1024, retries=3):
+        '''
+          Streams the resource at path into filename chunk by chunk
+          Data is written to filename + '.part' first, an interrupted transfer resumes
+          from the bytes already there with a Range request, and the file is renamed
+          to filename once complete.
+          returns the filename and the number of bytes
+        '''
+        import requests
+        self._connect_if_needed()
+        part = filename + '.part'
+        attempt = 0
+        while True:
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+            try:
+                resp = self._get(path, headers=headers, stream=True, priority=PRIORITY_BULK)
+                try:
+                    if resp.status_code == 416 and resp.headers.get('Content-Range') == 'bytes */%d' % offset:
+                        break
+                    if resp.status_code == 416:
+                        os.remove(part)
+                        continue
+                    resp.raise_for_status()
+                    # a server ignoring the range sends the whole file again
+                    mode = 'ab' if resp.status_code == 206 else 'wb'
+                    with open(part, mode) as f:
+                        for chunk in resp.iter_content(chunk_size):
+                            f.write(chunk)
+                finally:
+                    resp.close()
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                attempt += 1
+                if attempt > retries:
+                    raise
+        os.replace(part, filename)
+        return filename, os.path.getsize(filename)
+
 ###############################################################################
 ##  Wrapped Functions
 ###############################################################################
     def list_network_ids(self):
         self._connect_if_needed()
-        ids = []
-        resp = requests.get(self._path("networks"), headers=self._auth_headers)
-        resp = resp.json()
-        for network in resp['networks']:
-            if not resp['summary'][str(network['id'])]['onboarded']:
-                continue
-            ids.append(network['id'])
-        return ids
+        return [network['id'] for network in self._onboarded_networks()]
 
     def list_camera_ids(self):
-        ids = []
-        resp = requests.get(self._path("networks"), headers=self._auth_headers)
-        resp = resp.json()
-        for network in resp['networks']:
-            if not resp['summary'][str(network['id'])]['onboarded']:
-                continue
-
-            camurl = self._path("network/"+str(network['id'])+"/cameras")
-            respcam = requests.get(camurl, headers=self._auth_headers)
-            respcam = respcam.json()
-            for camera in respcam['devicestatus']:
-                ids.append(camera['camera_id'])
-
-        return ids
+        self._connect_if_needed()
+        self.sweep_errors = []
+        return [camera['camera_id'] for network, camera in self._all_cameras()]
 
-    def refresh_all_cameras_thumbnail(self):
+    def refresh_all_cameras_thumbnail(self, timeout=30):
         '''
           Refresh all cameras with lastest thumbnails
+          Returns once every camera finished or timeout seconds passed, with the
+          completion status of every camera, see wait_for_commands
         '''
         self._connect_if_needed()
+        return self._refresh_all_cameras('thumbnail', timeout)
 
-        resp = requests.get(self._path("networks"), headers=self._auth_headers)
-        resp = resp.json()
-        for network in resp['networks']:
-            if not resp['summary'][str(network['id'])]['onboarded']:
-                continue
-            camurl = self._path("network/"+str(network['id'])+"/cameras")
-            respcam = requests.get(camurl, headers=self._auth_headers)
-            respcam = respcam.json()
-            for camera in respcam['devicestatus']:
-                capurl = self._path("network/"+str(network['id'])+"/camera/"+str(camera['camera_id'])+"/thumbnail")
-                rescap = requests.post(capurl, headers=self._auth_headers)
-        sleep(1.5)
-        return ;
-
-    def refresh_all_cameras_video(self):
+    def refresh_all_cameras_video(self, timeout=60):
         '''
-          Refresh all cameras with lastest thumbnails
+          Refresh all cameras with lastest videos
+          Returns once every camera finished or timeout seconds passed, with the
+          completion status of every camera, see wait_for_commands
         '''
         self._connect_if_needed()
-
-        resp = requests.get(self._path("networks"), headers=self._auth_headers)
-        resp = resp.json()
-        for network in resp['networks']:
-            if not resp['summary'][str(network['id'])]['onboarded']:
+        return self._refresh_all_cameras('clip', timeout)
+
+    def _refresh_all_cameras(self, command, timeout):
+        def refresh(network, camera):
+            capurl = "network/"+str(network['id'])+"/camera/"+str(camera['camera_id'])+"/"+command
+            issued = monotonic()
+            return issued, self._post_json(capurl, priority=PRIORITY_CONTROL)
+
+        results = []
+        for network, camera, issued, error in self._sweep_cameras(refresh):
+            result = {'network_id': network['id'], 'camera_id': camera['camera_id'], 'command_id': None,
+                      'complete': False, 'status': None, 'latency': None, 'error': None}
+            if error is not None:
+                result['error'] = str(error)
+            else:
+                result['issued'], resp = issued
+                result['command_id'] = resp.get('id')
+                if result['command_id'] is None:
+                    result['error'] = resp.get('message', 'no command id')
+            results.append(result)
+        self.wait_for_commands([r for r in results if r['command_id'] is not None], timeout)
+        return results
+
+    def wait_for_commands(self, commands, timeout=30, interval=0.25, max_interval=2.0):
+        '''
+          Polls the status of commands concurrently until each completes or timeout seconds passed
+          commands: dicts with network_id, command_id and optionally the monotonic() time
+          the command was issued at. They are updated in place with complete, status and
+          latency, the seconds from issue to the poll that saw the command complete.
+          Each command is polled after interval seconds, backing off to max_interval.
+        '''
+        start = monotonic()
+        delays = {}
+        due = {}
+        for i, command in enumerate(commands):
+            command.setdefault('issued', start)
+            command['complete'] = False
+            delays[i] = interval
+            due[i] = command['issued'] + interval
+
+        def poll(i):
+            command = commands[i]
+            return self._get_json('network/%s/command/%s' % (command['network_id'], command['command_id']), priority=PRIORITY_CONTROL)
+
+        pending = set(due)
+        while pending:
+            now = monotonic()
+            if now - start >= timeout:
+                break
+            wake = min(due[i] for i in pending)
+            if wake > now:
+                sleep(min(wake, start + timeout) - now)
                 continue
-            camurl = self._path("network/"+str(network['id'])+"/cameras")
-            respcam = requests.get(camurl, headers=self._auth_headers)
-            respcam = respcam.json()
-            for camera in respcam['devicestatus']:
-                capurl = self._path("network/"+str(network['id'])+"/camera/"+str(camera['camera_id'])+"/clip")
-                # print("capture video url: " + capurl)
-                rescap = requests.post(capurl, headers=self._auth_headers).json()
-                print("capture video output: " + str(rescap))
-
-        sleep(8)
-        return ;
+            for i, status, error in self._fan_out(poll, sorted(i for i in pending if due[i] <= now)):
+                if error is None and status.get('complete'):
+                    commands[i]['complete'] = True
+                    commands[i]['status'] = status.get('status')
+                    commands[i]['latency'] = monotonic() - commands[i]['issued']
+                    pending.discard(i)
+                else:
+                    delays[i] = min(delays[i] * 1.5, max_interval)
+                    due[i] = monotonic() + delays[i]
+        return commands
 
 
     def events_from_camera(self, camera_id, max_count = 5):
+        return list(islice(self.iter_events(camera_id), max_count))
+
+    def iter_events(self, camera_id=None, since=None, until=None):
+        '''
+          Yields the events of all pages, newest first
+          The next page is fetched in the background while the current one is consumed.
+          Iteration stops at the first empty page or at the first event older than since.
+          camera_id: only yield the events of this camera
+          since, until: bounds of created_at, datetimes or timestamp strings
+        '''
         self._connect_if_needed()
+        since = parse_timestamp(since) if since is not None else None
+        until = parse_timestamp(until) if until is not None else None
+
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            pagenumber = 0
+            nextpage = pool.submit(self._events_page, pagenumber)
+            while True:
+                page = nextpage.result()
+                if not page:
+                    return
+                pagenumber = pagenumber + 1
+                nextpage = pool.submit(self._events_page, pagenumber)
+                for event in page:
+                    if since is not None or until is not None:
+                        created_at = parse_timestamp(event['created_at'])
+                        if since is not None and created_at < since:
+                            return
+                        if until is not None and created_at > until:
+                            continue
+                    if camera_id is not None and event['camera_id'] != camera_id:
+                        continue
+                    yield Event(**event)
+        finally:
+            pool.shutdown(wait=False)
+
+    def list_all_events(self):
+        '''
+          Returns the events of all pages, newest first
+          The page range is planned from get_video_count and fetched concurrently, at most
+          max_workers pages at a time. Pages past the planned range are read until a short
+          page, and events shifting between pages while listing are returned only once.
+        '''
+        self._connect_if_needed()
+        count = self.get_video_count()
+        first = self._events_page(0)
+        if not first:
+            return []
+        pagesize = len(first)
+        pages = [first]
+        planned = range(1, (count + pagesize - 1) // pagesize)
+        for pagenumber, page, error in self._fan_out(self._events_page, planned):
+            if error is not None:
+                raise error
+            pages.append(page)
+        # clips recorded while listing push older ones past the planned range
+        pagenumber = len(pages)
+        while len(pages[-1]) == pagesize:
+            pages.append(self._events_page(pagenumber))
+            pagenumber = pagenumber + 1
 
         events = []
-        pagenumber = -1
-        while len(events) < max_count:
-            pagenumber = pagenumber + 1
-            resp = requests.get(self._path('api/v2/videos/page/'+str(pagenumber)), headers=self._auth_headers)
-            currentEvents = resp.json()
-            for event in currentEvents:
-                if event['camera_id'] == camera_id:
-                    events.append(Event(**event))
-                    if(len(events) >= max_count):
-                        break;
+        seen = set()
+        for page in pages:
+            if not page:
+                break
+            for event in page:
+                if event['id'] in seen:
+                    continue
+                seen.add(event['id'])
+                events.append(Event(**event))
         return events
 
+    def sync(self, index, since=None):
+        '''
+          Adds the events recorded since the last sync to the EventIndex index
+          Pages are read only until the watermark of the previous sync is reached.
+          since: where the first sync, with no watermark yet, starts, as a datetime or
+          timestamp string; by default it reads the whole history
+          Returns the newly indexed events, to be downloaded
+        '''
+        events = list(self.iter_events(since=index.watermark or since))
+        added = index.add(events)
+        index.advance_watermark(events)
+        return added
+
+    def archive(self, path, **kwargs):
+        '''
+          Downloads every event not archived yet below path, see Archiver for the options
+          Returns the ArchiveStats of the run
+        '''
+        return Archiver(self, path, **kwargs).run()
+
 
 ###############################################################################
 ##  Other Client APIs
@@ -293,8 +1893,8 @@ class Blink(object):
           Notes: Probably not strictly needed but checking result can verify that the sync module is online and will respond to requests to arm/disarm, etc.
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path('network/%s/syncmodules' % network.id), headers=self._auth_headers)
-        return [SyncModule(**resp.json()['syncmodule'])]
+        resp = self._get('network/%s/syncmodules' % network.id)
+        return [SyncModule(**json_loads(resp.content)['syncmodule'])]
 
     def arm(self, network):
         '''
@@ -303,8 +1903,8 @@ class Blink(object):
           Notes: When this call returns, it does not mean the disarm request is complete, the client must gather the request ID from the response and poll for the status of the command.
         '''
         self._connect_if_needed()
-        resp = requests.post(self._path('network/%s/arm' % network.id), headers=self._auth_headers)
-        return resp.json()
+        resp = self._post('network/%s/arm' % network.id, priority=PRIORITY_CONTROL)
+        return json_loads(resp.content)
 
     def disarm(self, network):
         '''
@@ -313,8 +1913,8 @@ class Blink(object):
           Notes: When this call returns, it does not mean the disarm request is complete, the client must gather the request ID from the response and poll for the status of the command.
         '''
         self._connect_if_needed()
-        resp = requests.post(self._path('network/%s/disarm' % network.id), headers=self._auth_headers)
-        return resp.json()
+        resp = self._post('network/%s/disarm' % network.id, priority=PRIORITY_CONTROL)
+        return json_loads(resp.content)
 
     def command_status(self, network, command_id):
         '''
@@ -324,66 +1924,104 @@ class Blink(object):
           Known Commands: lv_relay, arm, disarm, thumbnail, clip
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path('network/%s/command/%s' % (network.id, command_id)), headers=self._auth_headers)
-        return resp.json()
+        resp = self._get('network/%s/command/%s' % (network.id, command_id), priority=PRIORITY_CONTROL)
+        return json_loads(resp.content)
 
     def get_video_info(self, id):
         self._connect_if_needed()
-        resp = requests.get(self._path('api/v2/video/'+str(id)), headers=self._auth_headers)
-        return resp.json()
+        resp = self._get('api/v2/video/'+str(id))
+        return json_loads(resp.content)
 
     def get_unwatched_videos(self):
         self._connect_if_needed()
-        resp = requests.get(self._path('api/v2/videos/unwatched/page/0'), headers=self._auth_headers)
-        videos = resp.json()
+        resp = self._get('api/v2/videos/unwatched/page/0')
+        videos = json_loads(resp.content)
         videos = [Video(**video) for video in videos]
         return videos
 
     def delete_video(self, id):
         self._connect_if_needed()
-        resp = requests.post(self._path('api/v2/video/'+str(id)+"/delete"), headers=self._auth_headers)
-        return resp.json()['code'] == 704
+        resp = self._post('api/v2/video/'+str(id)+"/delete")
+        return json_loads(resp.content)['code'] == 704
 
-    def get_camera_info(self):
+    def delete_videos(self, ids=None, camera_id=None, older_than=None, where=None, retries=2, progress=None):
+        '''
+          Deletes many clips concurrently, at most max_workers at a time
+          ids: ids of the clips to delete, otherwise they are selected from list_all_events:
+            camera_id: only the clips of this camera
+            older_than: only the clips recorded more than this many days ago
+            where: only the events for which where(event) is true
+          retries: how often a deletion failing with an error is repeated, on top of the
+            429 retries of every request. A clip not found once a failed attempt may have
+            deleted it counts as deleted.
+          progress: called with the DeleteStats after every clip
+          Returns the DeleteStats, its outcomes map every id to True or the reason it failed
+        '''
         self._connect_if_needed()
+        if ids is None:
+            since = datetime.now(timezone.utc).timestamp() - older_than * 86400 if older_than is not None else None
+            ids = [event.id for event in self.list_all_events()
+                   if (camera_id is None or event.camera_id == camera_id)
+                   and (since is None or _epoch(event.created_at_raw) < since)
+                   and (where is None or where(event))]
+        stats = DeleteStats()
+        lock = Lock()
+
+        def delete(id):
+            attempt = 0
+            while True:
+                try:
+                    resp = self._post_json('api/v2/video/'+str(id)+"/delete", priority=PRIORITY_BULK)
+                    deleted = resp.get('code') == 704 or (attempt and resp.get('code') == 700)
+                    outcome = True if deleted else resp.get('message', 'code %s' % resp.get('code'))
+                    break
+                except Exception as e:
+                    if attempt >= retries:
+                        outcome = str(e)
+                        break
+                    sleep(self._retry_delay(getattr(e, 'response', None), attempt))
+                    attempt += 1
+            with lock:
+                stats.outcomes[id] = outcome
+                if outcome is True:
+                    stats.deleted += 1
+                else:
+                    stats.failed += 1
+                if progress is not None:
+                    progress(stats)
+
+        self._fan_out(delete, ids)
+        stats.finished = monotonic()
+        return stats
 
-        cameraInfos = []
+    def get_camera_info(self):
+        self._connect_if_needed()
 
-        resp = requests.get(self._path("networks"), headers=self._auth_headers)
-        resp = resp.json()
-        for network in resp['networks']:
-            if not resp['summary'][str(network['id'])]['onboarded']:
-                continue
-            camurl = self._path("network/"+str(network['id'])+"/cameras")
-            respcam = requests.get(camurl, headers=self._auth_headers)
-            respcam = respcam.json()
-            for camera in respcam['devicestatus']:
-                capurl = self._path("network/"+str(network['id'])+"/camera/"+str(camera['camera_id']))
-                cameraInfo = requests.get(capurl, headers=self._auth_headers).json()
-                cameraInfos.append(cameraInfo)
+        def camera_info(network, camera):
+            capurl = "network/"+str(network['id'])+"/camera/"+str(camera['camera_id'])
+            return self._get_json(capurl)
 
+        cameraInfos = []
+        for network, camera, cameraInfo, error in self._sweep_cameras(camera_info):
+            if error is not None:
+                cameraInfo = self._sweep_error_info(network, camera, error)
+            cameraInfos.append(cameraInfo)
         return cameraInfos
 
     def get_camera_sensor_info(self):
         self._connect_if_needed()
 
-        cameraSensorInfos = []
-
-        resp = requests.get(self._path("networks"), headers=self._auth_headers)
-        resp = resp.json()
-        for network in resp['networks']:
-            if not resp['summary'][str(network['id'])]['onboarded']:
-                continue
-            camurl = self._path("network/"+str(network['id'])+"/cameras")
-            respcam = requests.get(camurl, headers=self._auth_headers)
-            respcam = respcam.json()
-            for camera in respcam['devicestatus']:
-                capurl = self._path("network/"+str(network['id'])+"/camera/"+str(camera['camera_id']) + "/signals")
-                cameraSensorInfo = requests.get(capurl, headers=self._auth_headers).json()
-                cameraSensorInfo['network_id'] = network['id']
-                cameraSensorInfo['camera_id'] = camera['camera_id']
-                cameraSensorInfos.append(cameraSensorInfo)
+        def camera_sensor_info(network, camera):
+            capurl = "network/"+str(network['id'])+"/camera/"+str(camera['camera_id']) + "/signals"
+            return self._get_json(capurl)
 
+        cameraSensorInfos = []
+        for network, camera, cameraSensorInfo, error in self._sweep_cameras(camera_sensor_info):
+            if error is not None:
+                cameraSensorInfo = self._sweep_error_info(network, camera, error)
+            cameraSensorInfo['network_id'] = network['id']
+            cameraSensorInfo['camera_id'] = camera['camera_id']
+            cameraSensorInfos.append(cameraSensorInfo)
         return cameraSensorInfos
 
     def clients(self):
@@ -392,16 +2030,16 @@ class Blink(object):
           Response JSON response containing client information, including: type, name, connection time, user ID
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path('account/clients'), headers=self._auth_headers)
-        return resp.json()
+        resp = self._get('account/clients')
+        return json_loads(resp.content)
 
     def regions(self):
         '''
           Gets information about supported regions
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path('regions'), headers=self._auth_headers)
-        return resp.json()
+        resp = self._get('regions')
+        return json_loads(resp.content)
 
 
 ###############################################################################
@@ -409,8 +2047,8 @@ class Blink(object):
 ###############################################################################
     def events(self, network, type='motion'):
         self._connect_if_needed()
-        resp = requests.get(self._path('events/network/%s' % network.id), headers=self._auth_headers)
-        events = resp.json()['event']
+        resp = self._get('events/network/%s' % network.id)
+        events = json_loads(resp.content)['event']
         if type: events = [e for e in events if e['type']=='motion']
         events = [Event(**event) for event in events]
         return events
@@ -420,7 +2058,7 @@ class Blink(object):
           returns the mp4 data as a file-like object
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path(event.video_url), headers=self._auth_headers)
+        resp = self._get(event.video_url)
         return resp.content
 
     def download_thumbnail(self, event):
@@ -429,8 +2067,8 @@ class Blink(object):
           doesn't work - server returns 404
         '''
         self._connect_if_needed()
-        thumbnail_url = self._path(event.video_url[:-4] + '.jpg')
-        resp = requests.get(thumbnail_url, headers=self._auth_headers)
+        thumbnail_url = event.video_url[:-4] + '.jpg'
+        resp = self._get(thumbnail_url)
         return resp.content
 
     def health(self):
@@ -438,29 +2076,1454 @@ class Blink(object):
           Gets information about system health
         '''
         self._connect_if_needed()
-        resp = requests.get(self._path('health'), headers=self._auth_headers)
-        return resp.json()
+        resp = self._get('health')
+        return json_loads(resp.content)
 
-    def archive(self, path):
-        self._connect_if_needed()
-        for network in self.networks:
-            network_dir = os.path.join(path, network['name'])
-            if not os.path.isdir(network_dir):
-                os.mkdir(network_dir)
 
-            already_downloaded = set()
-            for fn in os.listdir(network_dir):
-                if not fn.endswith('.mp4'): continue
-                fn = fn[:-4]
-                event_id = int(fn.split(' - ')[0])
-                already_downloaded.add(event_id)
+###############################################################################
+##  Storage
+###############################################################################
+
+class StoredFile(object):
+    '''
+      A file handed to a StorageWriter, location is set by the sink once it is written
+    '''
+    __slots__ = ('name', 'event', 'size', 'location', 'callback', 'temp', 'file')
+
+    def __init__(self, name, event=None, size=None, callback=None):
+        self.name = name
+        self.event = event
+        self.size = size
+        self.location = None
+        self.callback = callback
+        self.temp = None
+        self.file = None
 
-            events = self.events(network['id'])
-            for event in events:
-                if event['id'] in already_downloaded: continue
-                when = dateutil.parser.parse(event['created_at'])
-                event_fn = os.path.join(network_dir, '%s - %s @ %s.mp4' % (event['id'], event['camera_name'], when.strftime('%Y-%m-%d %I:%M:%S %p %Z')))
-                print('Saving:', event_fn)
-                mp4 = self.download_video(event)
-                with open(event_fn,'w') as f:
-                    f.write(mp4)
+    def __repr__(self):
+        return '<StoredFile %s>' % (self.location or self.name)
+
+
+_temp_ids = itertools.count()
+
+def _fsync_directory(path):
+    # makes renames inside path durable, not possible on every platform
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class DirectorySink(object):
+    '''
+      Stores files below path, placed by layout
+      layout fields: {name} the file name, {date} the yyyy-mm-dd of the event, {camera}
+      and {network} its camera and network names (ids if unnamed), {id} the event id.
+      Files are written to a temporary name and renamed on commit.
+    '''
+
+    def __init__(self, path, layout='{date}/{camera}/{name}'):
+        self.path = path
+        self.layout = layout
+
+    def relative_path(self, stored):
+        event = stored.event
+        fields = {'name': stored.name, 'date': 'undated', 'camera': '', 'network': '', 'id': ''}
+        if event is not None:
+            if event.created_at is not None:
+                fields['date'] = event.created_at.strftime('%Y-%m-%d')
+            fields['camera'] = event.camera_name or str(event.camera_id or '')
+            fields['network'] = event.network_name or str(event.network_id or '')
+            fields['id'] = str(event.id)
+        for key in ('camera', 'network', 'name'):
+            fields[key] = fields[key].replace('/', '_').replace(os.sep, '_')
+        return os.path.normpath(self.layout.format(**fields))
+
+    def write(self, stored, chunks, fsync):
+        stored.location = os.path.join(self.path, self.relative_path(stored))
+        self._write_temp(stored, stored.location, chunks, fsync)
+
+    def _write_temp(self, stored, location, chunks, fsync):
+        directory = os.path.dirname(location)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        stored.temp = '%s.%d.part' % (location, next(_temp_ids))
+        f = open(stored.temp, 'wb')
+        try:
+            if stored.size and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, stored.size)
+                except OSError:
+                    pass
+            size = 0
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+            if stored.size and size < stored.size:
+                f.truncate(size)
+            stored.size = size
+        except BaseException:
+            f.close()
+            os.remove(stored.temp)
+            raise
+        if fsync:
+            # kept open until the batch is synced
+            stored.file = f
+        else:
+            f.close()
+
+    def commit(self, batch, fsync):
+        '''
+          Makes the written files of batch visible, durably if fsync is set
+          Returns the files committed
+        '''
+        for stored in batch:
+            if stored.file is not None:
+                stored.file.flush()
+                os.fsync(stored.file.fileno())
+                stored.file.close()
+                stored.file = None
+        for stored in batch:
+            os.replace(stored.temp, stored.location)
+            stored.temp = None
+        if fsync:
+            for directory in set(os.path.dirname(stored.location) for stored in batch):
+                _fsync_directory(directory)
+        return batch
+
+    def close(self, fsync):
+        return []
+
+
+class ContentAddressedSink(DirectorySink):
+    '''
+      Stores every distinct content once, as path/<2 hex digits>/<sha256><extension of the name>
+      A file whose content is stored already is not written again.
+    '''
+
+    def __init__(self, path):
+        DirectorySink.__init__(self, path)
+
+    def write(self, stored, chunks, fsync):
+        from hashlib import sha256
+        digest = sha256()
+
+        def hashed():
+            for chunk in chunks:
+                digest.update(chunk)
+                yield chunk
+
+        # the content is hashed while it is written, the location is only known at the end
+        self._write_temp(stored, os.path.join(self.path, 'incoming'), hashed(), fsync)
+        digest = digest.hexdigest()
+        stored.location = os.path.join(self.path, digest[:2], digest + os.path.splitext(stored.name)[1])
+        if os.path.exists(stored.location):
+            if stored.file is not None:
+                stored.file.close()
+                stored.file = None
+            os.remove(stored.temp)
+            stored.temp = None
+            return
+        directory = os.path.dirname(stored.location)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def commit(self, batch, fsync):
+        DirectorySink.commit(self, [stored for stored in batch if stored.temp is not None], fsync)
+        return batch
+
+
+class RollupSink(DirectorySink):
+    '''
+      Collects small files such as thumbnails into tar or zip archives of up to max_bytes
+      The archives are written as path/<prefix>-<first file time>-<n>.<format>.part and
+      renamed once full or on close; the files in them are committed only then.
+      location is '<archive>/<member>', members are placed by layout.
+    '''
+
+    def __init__(self, path, format='tar', max_bytes=64*1024*1024, layout='{date}/{camera}/{name}', prefix='rollup'):
+        if format not in ('tar', 'zip'):
+            raise ValueError('format must be tar or zip')
+        DirectorySink.__init__(self, path, layout)
+        self.format = format
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._archive = None
+        self._archive_path = None
+        self._archive_bytes = 0
+        self._members = []
+        self._count = 0
+        self._lock = Lock()
+
+    def _open(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        while True:
+            self._count += 1
+            self._archive_path = os.path.join(self.path, '%s-%d-%d.%s' % (self.prefix, int(time()), self._count, self.format))
+            if not os.path.exists(self._archive_path) and not os.path.exists(self._archive_path + '.part'):
+                break
+        if self.format == 'tar':
+            import tarfile
+            self._archive = tarfile.open(self._archive_path + '.part', 'w')
+        else:
+            import zipfile
+            self._archive = zipfile.ZipFile(self._archive_path + '.part', 'w', zipfile.ZIP_STORED)
+        self._archive_bytes = 0
+
+    def write(self, stored, chunks, fsync):
+        data = b''.join(chunks)
+        member = self.relative_path(stored).replace(os.sep, '/')
+        event = stored.event
+        mtime = _epoch(event.created_at_raw) if event is not None and event.created_at_raw else time()
+        with self._lock:
+            if self._archive is None:
+                self._open()
+            if self.format == 'tar':
+                import io, tarfile
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                info.mtime = mtime
+                self._archive.addfile(info, io.BytesIO(data))
+            else:
+                import zipfile
+                info = zipfile.ZipInfo(member, datetime.fromtimestamp(mtime).timetuple()[:6])
+                self._archive.writestr(info, data)
+            stored.size = len(data)
+            stored.location = self._archive_path + '/' + member
+            self._archive_bytes += len(data)
+            self._members.append(stored)
+
+    def commit(self, batch, fsync):
+        with self._lock:
+            if self._archive is None or self._archive_bytes < self.max_bytes:
+                return []
+            return self._roll(fsync)
+
+    def _roll(self, fsync):
+        self._archive.close()
+        if fsync:
+            with open(self._archive_path + '.part', 'rb') as f:
+                os.fsync(f.fileno())
+        os.replace(self._archive_path + '.part', self._archive_path)
+        if fsync:
+            _fsync_directory(self.path)
+        committed, self._members = self._members, []
+        self._archive = None
+        return committed
+
+    def close(self, fsync):
+        with self._lock:
+            return self._roll(fsync) if self._archive is not None else []
+
+
+class StorageWriter(object):
+    '''
+      Writes files on a pool of writer threads, so downloads never wait for the disk
+
+      submit() hands over the content and returns at once, unless more than max_inflight_bytes
+      are waiting to be written. Written files are committed in batches: with fsync set,
+      every fsync_every files or fsync_interval seconds they are synced together, then
+      renamed to their final name. callback(stored, error) is called after the commit, or
+      with the error when writing failed.
+    '''
+
+    def __init__(self, sink, writers=2, max_inflight_bytes=64*1024*1024, fsync=True, fsync_every=32, fsync_interval=1.0):
+        '''
+          sink: DirectorySink, ContentAddressedSink, RollupSink or a directory for a DirectorySink
+        '''
+        if not hasattr(sink, 'commit'):
+            sink = DirectorySink(sink)
+        self.sink = sink
+        self.max_inflight_bytes = max_inflight_bytes
+        self.fsync = fsync
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.files = 0
+        self.bytes = 0
+        self.commits = 0
+        self.errors = 0
+        self._queue = queue.Queue()
+        self._inflight_bytes = 0
+        self._outstanding = 0
+        self._cond = Condition()
+        self._pending = []
+        self._last_commit = monotonic()
+        self._commit_lock = Lock()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work) for i in range(writers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, name, data, event=None, size=None, callback=None):
+        '''
+          Queues data, bytes or an iterable of bytes, to be stored as name
+          size: length of data if it is an iterable, used to preallocate the file
+          Returns the StoredFile, its location is set once written
+        '''
+        if self._closed:
+            raise BlinkError('StorageWriter is closed')
+        if isinstance(data, bytes):
+            size = len(data)
+            data = [data]
+        stored = StoredFile(name, event, size, callback)
+        cost = size or 0
+        with self._cond:
+            # a single file larger than the cap is let through once nothing else is in flight
+            while self._inflight_bytes and self._inflight_bytes + cost > self.max_inflight_bytes:
+                self._cond.wait()
+            self._inflight_bytes += cost
+            self._outstanding += 1
+        self._queue.put((stored, data, cost))
+        return stored
+
+    def open(self, name, event=None, size=None, callback=None):
+        '''
+          Starts a file whose content arrives in chunks, e.g. a download in progress
+          size: expected length, used to preallocate the file
+          Returns a _FileStream: write() every chunk to it, then close() it, or abort(error).
+          A writer thread stores the chunks as they arrive; write() waits while more than
+          max_inflight_bytes are buffered and this file already has chunks waiting.
+        '''
+        if self._closed:
+            raise BlinkError('StorageWriter is closed')
+        stream = _FileStream(self, StoredFile(name, event, size, callback))
+        with self._cond:
+            self._outstanding += 1
+        self._queue.put((stream.stored, stream, 0))
+        return stream
+
+    def _work(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                item = None
+            if item is not None and item[0] is None:
+                return
+            if item is not None:
+                stored, data, cost = item
+                error = None
+                try:
+                    if isinstance(data, _FileStream):
+                        try:
+                            self.sink.write(stored, data.chunks(), self.fsync)
+                        finally:
+                            data.release()
+                    else:
+                        self.sink.write(stored, data, self.fsync)
+                except Exception as e:
+                    error = e
+                with self._cond:
+                    self._inflight_bytes -= cost
+                    if error is None:
+                        self._pending.append(stored)
+                    self._cond.notify_all()
+                if error is not None:
+                    self._done([stored], error)
+            with self._cond:
+                due = len(self._pending) >= self.fsync_every or (
+                    self._pending and monotonic() - self._last_commit >= self.fsync_interval)
+            if due:
+                self.commit()
+
+    def commit(self):
+        '''
+          Commits the files written so far, as far as the sink allows
+        '''
+        with self._commit_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                self._last_commit = monotonic()
+            self._commit(batch, self.sink.commit)
+
+    def _commit(self, batch, commit):
+        try:
+            committed = commit(batch, self.fsync)
+        except Exception as e:
+            self._done(batch, e)
+            return
+        done = set(id(stored) for stored in committed)
+        with self._cond:
+            # files the sink holds back, e.g. in an unfinished archive, wait for the next commit
+            self._pending = [stored for stored in batch if id(stored) not in done] + self._pending
+        if committed:
+            self.commits += 1
+        self._done(committed, None)
+
+    def _done(self, files, error):
+        for stored in files:
+            with self._cond:
+                self._outstanding -= 1
+                if error is None:
+                    self.files += 1
+                    self.bytes += stored.size or 0
+                else:
+                    self.errors += 1
+                self._cond.notify_all()
+            if stored.callback is not None:
+                stored.callback(stored, error)
+
+    def flush(self):
+        '''
+          Waits until every submitted file is written and commits them
+          Files held back by a RollupSink are committed by close.
+        '''
+        with self._cond:
+            while self._outstanding > len(self._pending) or not self._queue.empty():
+                self._cond.wait(0.1)
+        self.commit()
+
+    def close(self):
+        '''
+          Writes and commits everything submitted, then stops the writer threads
+        '''
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        for thread in self._threads:
+            self._queue.put((None, None, 0))
+        for thread in self._threads:
+            thread.join()
+        with self._commit_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            self._commit(batch, lambda batch, fsync: self.sink.close(fsync))
+
+class _FileStream(object):
+    '''
+      The chunks of a file handed from its producer to a writer thread of a StorageWriter
+    '''
+
+    def __init__(self, writer, stored):
+        self.writer = writer
+        self.stored = stored
+        self._chunks = deque()
+        self._finished = False
+        self._error = None
+        self._released = False
+
+    def write(self, chunk):
+        '''
+          Queues chunk, returns False once the file failed to be written and the rest is not needed
+        '''
+        writer = self.writer
+        with writer._cond:
+            # a file with nothing buffered may always go ahead, so the files being written never wait on each other
+            while (self._chunks and not self._released
+                   and writer._inflight_bytes + len(chunk) > writer.max_inflight_bytes):
+                writer._cond.wait()
+            if self._released:
+                return False
+            self._chunks.append(chunk)
+            writer._inflight_bytes += len(chunk)
+            writer._cond.notify_all()
+        return True
+
+    def close(self):
+        self._finish(None)
+
+    def abort(self, error):
+        '''
+          The content is incomplete, the file is not stored and its callback gets error
+        '''
+        self._finish(error)
+
+    def _finish(self, error):
+        with self.writer._cond:
+            self._finished = True
+            self._error = error
+            self.writer._cond.notify_all()
+
+    def chunks(self):
+        '''
+          Yields the chunks as they arrive, in the writer thread
+        '''
+        writer = self.writer
+        while True:
+            with writer._cond:
+                while not self._chunks and not self._finished:
+                    writer._cond.wait()
+                if self._chunks:
+                    chunk = self._chunks.popleft()
+                    writer._inflight_bytes -= len(chunk)
+                    writer._cond.notify_all()
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            yield chunk
+
+    def release(self):
+        '''
+          The writer is done with the file, drops what is still buffered
+        '''
+        writer = self.writer
+        with writer._cond:
+            self._released = True
+            writer._inflight_bytes -= sum(len(chunk) for chunk in self._chunks)
+            self._chunks.clear()
+            writer._cond.notify_all()
+
+###############################################################################
+##  Retention
+###############################################################################
+
+class EvictionStats(object):
+    def __init__(self):
+        self.evicted = 0
+        self.bytes = 0
+        self.deleted_remote = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return '<EvictionStats evicted=%d bytes=%d deleted_remote=%d failed=%d>' % (
+            self.evicted, self.bytes, self.deleted_remote, self.failed)
+
+
+class RetentionPolicy(object):
+    '''
+      Disk quota and retention of the clips recorded in an EventIndex
+
+      enforce() removes the clips older than max_age days (per camera overrides in
+      camera_max_age), then the oldest clips until the stored clips fit in max_bytes.
+      The index keeps the clips ordered by time and their total size, so a pass only
+      touches the clips it evicts. Evicted clips are not downloaded again; with
+      delete_remote they are also deleted on the server.
+
+      An archive of a RollupSink cannot be shrunk in place, so evicting a clip stored
+      in one evicts the whole archive with every clip in it. Archives are filled in
+      time order, so their clips are about the same age.
+    '''
+
+    def __init__(self, max_bytes=None, max_age=None, camera_max_age=None, delete_remote=False, batch=100):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.camera_max_age = dict(camera_max_age or {})
+        self.delete_remote = delete_remote
+        self.batch = batch
+        self._lock = Lock()
+
+    def _cutoff(self, days):
+        return (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+    def expired(self, event):
+        '''
+          Whether the event is past its retention, so it is not worth downloading
+        '''
+        days = self.camera_max_age.get(event.camera_id, self.max_age)
+        return days is not None and event.created_at is not None and \
+            event.created_at < datetime.now(timezone.utc) - timedelta(days=days)
+
+    def over_quota(self, index):
+        return self.max_bytes is not None and index.stored_bytes > self.max_bytes
+
+    def enforce(self, index, blink=None, root=None):
+        '''
+          Evicts the clips of index beyond the retention and the quota
+          blink: client to delete the evicted clips on the server, with delete_remote
+          root: directory of the archive, directories emptied below it are removed
+          Returns the EvictionStats of the pass
+        '''
+        stats = EvictionStats()
+        evicted = []
+        with self._lock:
+            for camera_id, days in self.camera_max_age.items():
+                if days is not None:
+                    self._evict(index, stats, evicted, camera_id=camera_id, before=self._cutoff(days))
+            if self.max_age is not None:
+                cutoff = self._cutoff(self.max_age)
+                self._evict(index, stats, evicted, before=cutoff,
+                            keep=lambda row: row['camera_id'] in self.camera_max_age)
+            if self.max_bytes is not None:
+                self._evict(index, stats, evicted, until=lambda: index.stored_bytes <= self.max_bytes)
+            for row in evicted:
+                self._remove(row, index, root)
+        if self.delete_remote and blink is not None and evicted:
+            deleted = blink.delete_videos([row['id'] for row in evicted])
+            stats.deleted_remote = deleted.deleted
+            stats.failed += deleted.failed
+        return stats
+
+    def _evict(self, index, stats, evicted, camera_id=None, before=None, keep=None, until=None):
+        skipped = 0
+        while until is None or not until():
+            rows = index.oldest(self.batch + skipped, camera_id, before)[skipped:]
+            if not rows:
+                return
+            archived = set()
+            for row in rows:
+                if until is not None and until():
+                    return
+                if row['id'] in archived:
+                    continue
+                if keep is not None and keep(row):
+                    # ruled by its own camera retention
+                    skipped += 1
+                    continue
+                archive = self._archive_of(row['path'])
+                members = index.in_archive(archive) if archive is not None else [row]
+                for member in members:
+                    index.mark_evicted(member['id'])
+                    stats.evicted += 1
+                    stats.bytes += member['size'] or 0
+                    evicted.append(member)
+                    archived.add(member['id'])
+
+    @staticmethod
+    def _archive_of(path):
+        '''
+          Returns the archive holding path when it is '<archive>/<member>', else None
+        '''
+        if not path or os.path.exists(path):
+            return None
+        directory = os.path.dirname(path)
+        while directory and directory != os.path.dirname(directory):
+            if os.path.isfile(directory):
+                return directory
+            if os.path.isdir(directory):
+                return None
+            directory = os.path.dirname(directory)
+        return None
+
+    def _remove(self, row, index, root):
+        path = self._archive_of(row['path']) or row['path']
+        if not path or not os.path.isfile(path) or index.path_shared(row['id'], path):
+            # files shared by a ContentAddressedSink stay, as do archives already removed
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        directory = os.path.dirname(path)
+        while root is not None and os.path.abspath(directory) != os.path.abspath(root) and \
+                os.path.abspath(directory).startswith(os.path.abspath(root)):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+###############################################################################
+##  Change Detection
+###############################################################################
+
+def decode_thumbnail(content):
+    '''
+      Decodes jpg bytes into a 2D array of gray levels, requires Pillow
+    '''
+    from io import BytesIO
+    import numpy
+    from PIL import Image
+    return numpy.asarray(Image.open(BytesIO(content)).convert('L'))
+
+class ChangeDetector(object):
+    '''
+      Scores how much a thumbnail changed since the previous one of the same key
+
+      Thumbnails are decoded to gray levels and downscaled to size x size by area
+      averaging, then a whole batch is compared at once with the previous frames of
+      their keys, e.g. camera ids. The score is the larger of the share of differing
+      bits of the difference hashes and the mean absolute difference of the frames,
+      from 0 for the same scene to 1. A key seen for the first time and a thumbnail that
+      cannot be decoded score 1, so a decoding problem never hides a clip.
+
+      NumPy, and Pillow for the default decoder, are only imported once thumbnails are scored.
+    '''
+
+    def __init__(self, size=16, threshold=0.1, decoder=None):
+        '''
+          size: side of the downscaled frames, the hashes have size * (size - 1) bits
+          threshold: lowest score that counts as changed
+          decoder: turns jpg bytes into a 2D or 3D array, defaults to decode_thumbnail
+        '''
+        self.size = size
+        self.threshold = threshold
+        self.decoder = decoder or decode_thumbnail
+        # last score, frame and hash of every key
+        self.scores = {}
+        self._frames = {}
+        self._hashes = {}
+        self._lock = Lock()
+
+    def downscale(self, image):
+        '''
+          Returns image as a size x size float32 array of gray levels between 0 and 1
+        '''
+        import numpy
+        image = numpy.asarray(image, dtype=numpy.float32)
+        if image.ndim == 3:
+            image = image.mean(axis=2)
+        size = self.size
+        height, width = image.shape
+        if height < size or width < size:
+            # repeat the pixels of small images up to size first
+            rows = numpy.arange(max(height, size)) * height // max(height, size)
+            columns = numpy.arange(max(width, size)) * width // max(width, size)
+            image = image[rows][:, columns]
+            height, width = image.shape
+        image = image[:height - height % size, :width - width % size]
+        return image.reshape(size, height // size, size, width // size).mean(axis=(1, 3)) / 255.0
+
+    def _decode(self, contents):
+        '''
+          Returns the frames of contents stacked, their hashes and for each content
+          the row of its frame, None if it could not be decoded
+        '''
+        import numpy
+        frames, rows = [], []
+        for content in contents:
+            try:
+                frames.append(self.downscale(self.decoder(content)))
+                rows.append(len(frames) - 1)
+            except Exception:
+                rows.append(None)
+        if not frames:
+            return None, None, rows
+        frames = numpy.stack(frames)
+        # difference hash: whether each pixel is brighter than its left neighbour
+        return frames, frames[:, :, 1:] > frames[:, :, :-1], rows
+
+    def _changes(self, frames, hashes, reference, reference_hashes):
+        import numpy
+        difference = numpy.abs(frames - reference).mean(axis=(-2, -1))
+        distance = (hashes != reference_hashes).mean(axis=(-2, -1))
+        return numpy.maximum(difference, distance)
+
+    def update(self, images):
+        '''
+          images: dict of key -> jpg bytes
+          Returns a dict of key -> score, the images become the previous ones of their keys
+        '''
+        import numpy
+        keys = list(images)
+        frames, hashes, rows = self._decode([images[key] for key in keys])
+        scores = dict((key, 1.0) for key in keys)
+        with self._lock:
+            seen = [(key, row) for key, row in zip(keys, rows) if row is not None and key in self._frames]
+            if seen:
+                changes = self._changes(frames[[row for key, row in seen]], hashes[[row for key, row in seen]],
+                                        numpy.stack([self._frames[key] for key, row in seen]),
+                                        numpy.stack([self._hashes[key] for key, row in seen]))
+                for (key, row), score in zip(seen, changes):
+                    scores[key] = float(score)
+            for key, row in zip(keys, rows):
+                if row is not None:
+                    self._frames[key] = frames[row]
+                    self._hashes[key] = hashes[row]
+            self.scores.update(scores)
+        return scores
+
+    def scan(self, items):
+        '''
+          items: (key, jpg bytes) pairs, oldest first
+          Scores every thumbnail against the last one of its key that counted as changed.
+          Only those become the reference, so a slow drift adds up until it counts as a
+          change. The thumbnails of a key are scored at once up to the next change.
+          Returns the scores in the order of items.
+        '''
+        frames, hashes, rows = self._decode([content for key, content in items])
+        scores = [1.0] * len(items)
+        by_key = OrderedDict()
+        for i, ((key, content), row) in enumerate(zip(items, rows)):
+            if row is not None:
+                by_key.setdefault(key, []).append(i)
+        with self._lock:
+            for key, indices in by_key.items():
+                while indices:
+                    if key in self._frames:
+                        picked = [rows[i] for i in indices]
+                        changes = self._changes(frames[picked], hashes[picked], self._frames[key], self._hashes[key])
+                        changed = [n for n, score in enumerate(changes) if score >= self.threshold]
+                        for i, score in zip(indices, changes):
+                            scores[i] = float(score)
+                    else:
+                        changed = [0]
+                    if not changed:
+                        break
+                    # the first change becomes the reference of the thumbnails after it
+                    i = indices[changed[0]]
+                    self._frames[key] = frames[rows[i]]
+                    self._hashes[key] = hashes[rows[i]]
+                    indices = indices[changed[0] + 1:]
+            for (key, content), score in zip(items, scores):
+                self.scores[key] = score
+        return scores
+
+    def changed(self, key):
+        '''
+          Whether the last thumbnail of key scored at least threshold, True for unknown keys
+        '''
+        return self.scores.get(key, 1.0) >= self.threshold
+
+###############################################################################
+##  Archive Engine
+###############################################################################
+
+class ArchiveStats(object):
+    def __init__(self):
+        self.listed = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.evicted = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.interrupted = False
+        self.started = monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        '''
+          bytes per second written so far
+        '''
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return '<ArchiveStats listed=%d downloaded=%d failed=%d evicted=%d skipped=%d bytes=%d %.1f kB/s>' % (
+            self.listed, self.downloaded, self.failed, self.evicted, self.skipped, self.bytes, self.throughput / 1024)
+
+
+class Archiver(object):
+    '''
+      Concurrent archive pipeline: list -> filter -> download -> write
+
+      The lister walks the event pages down to the watermark of the EventIndex and queues
+      the events not stored yet, along with the ones left pending by a previous run.
+      downloaders threads stream the clips, sharing an optional bandwidth cap, chunk by chunk
+      to the writer threads of a StorageWriter, so a slow disk does not hold up the network
+      and memory stays flat whatever the clip size. They are stored as
+      path/<network>/<camera>_<clip>.mp4 by default.
+      Clips are recorded in the index once committed to storage. With a ChangeDetector the
+      events are only queued once the listing is complete: their thumbnails are scored
+      oldest first, in batches, against the last clip kept of their camera, and clips of
+      an unchanged scene are skipped.
+
+      SIGINT stops the run cleanly: clips already downloaded are still written, everything
+      else stays pending in the index and is picked up by the next run.
+    '''
+
+    def __init__(self, blink, path, index=None, downloaders=4, download_queue_size=16,
+                 bandwidth=None, chunk_size=64*1024, progress=None, sink=None, writers=2,
+                 max_write_bytes=64*1024*1024, fsync=True, retention=None, changes=None, changes_batch=32):
+        '''
+          index: EventIndex, defaults to path/events.db
+          downloaders: number of concurrent clip downloads
+          download_queue_size: bound of the queue between the lister and the downloaders
+          bandwidth: global download cap in bytes per second, None for unlimited
+          progress: called with the ArchiveStats after every stored or failed clip
+          sink: where the clips go, defaults to DirectorySink(path, '{network}/{name}')
+          writers, max_write_bytes, fsync: options of the StorageWriter, see there; there are at
+            least as many writers as downloaders, max_write_bytes bounds the chunks downloaded
+            but not written yet
+          retention: RetentionPolicy enforced before, during and after the run; clips past
+            their retention are not downloaded
+          changes: ChangeDetector keyed by camera id, clips scoring below its threshold are skipped
+          changes_batch: number of thumbnails fetched and scored together
+        '''
+        self.blink = blink
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.index = index if index is not None else EventIndex(os.path.join(path, 'events.db'))
+        self.downloaders = downloaders
+        self.chunk_size = chunk_size
+        self.bandwidth = TokenBucket(bandwidth) if bandwidth else None
+        self.progress = progress
+        self.retention = retention
+        self.changes = changes
+        self.changes_batch = changes_batch
+        self.stats = ArchiveStats()
+        # every download in progress needs a writer thread to stream into
+        self.storage = StorageWriter(sink or DirectorySink(path, '{network}/{name}'), writers=max(writers, downloaders),
+                                     max_inflight_bytes=max_write_bytes, fsync=fsync)
+        self._downloads = queue.Queue(download_queue_size)
+        self._stop = ThreadEvent()
+        self._listed = ThreadEvent()
+        self._stats_lock = Lock()
+
+    def stop(self):
+        '''
+          Ask the pipeline to stop, pending events stay in the index for the next run
+        '''
+        self._stop.set()
+
+    def run(self):
+        import signal
+        self.blink._connect_if_needed()
+        previous = None
+        if threading.current_thread() is threading.main_thread():
+            previous = signal.signal(signal.SIGINT, self._interrupt)
+        try:
+            self._enforce()
+            lister = threading.Thread(target=self._list)
+            downloaders = [threading.Thread(target=self._download) for i in range(self.downloaders)]
+            for thread in [lister] + downloaders:
+                thread.daemon = True
+                thread.start()
+            lister.join()
+            for thread in downloaders:
+                thread.join()
+            self.storage.close()
+            self._enforce()
+        finally:
+            if previous is not None:
+                signal.signal(signal.SIGINT, previous)
+        self.stats.interrupted = self._stop.is_set()
+        self.stats.finished = monotonic()
+        return self.stats
+
+    def _enforce(self):
+        if self.retention is not None:
+            evicted = self.retention.enforce(self.index, self.blink, self.path)
+            self._count(evicted=evicted.evicted)
+
+    def _interrupt(self, signum, frame):
+        import signal
+        # a second SIGINT falls back to the default KeyboardInterrupt
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        self.stop()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _take(self, q, upstream_done):
+        '''
+          Returns the next item of q, or None once q is drained and upstream_done is set
+        '''
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if upstream_done.is_set():
+                    # an item may have been put between the timeout and the check
+                    try:
+                        return q.get_nowait()
+                    except queue.Empty:
+                        return None
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for name, value in counts.items():
+                setattr(self.stats, name, getattr(self.stats, name) + value)
+        if self.progress is not None:
+            self.progress(self.stats)
+
+    def _list(self):
+        held = []
+        try:
+            for row in self.index.pending():
+                if not self._queue(Event(**row), held):
+                    return
+            listed = []
+            for event in self.blink.iter_events(since=self.index.watermark):
+                listed.append(event)
+                if self.index.add([event]) and not self._queue(event, held):
+                    return
+                self.stats.listed += 1
+            # only a complete listing may move the watermark, otherwise older events would be skipped next time
+            self.index.advance_watermark(listed)
+            self._queue_changed(held)
+        finally:
+            self._listed.set()
+
+    def _queue(self, event, held):
+        if self.changes is None:
+            return self._put(self._downloads, event)
+        held.append(event)
+        return True
+
+    def _queue_changed(self, events):
+        '''
+          Queues the events whose thumbnail changed, scoring every camera oldest first
+        '''
+        events.sort(key=lambda event: _epoch(event.created_at_raw))
+        for start in range(0, len(events), self.changes_batch):
+            batch = events[start:start + self.changes_batch]
+            thumbnails = self.blink._fan_out(lambda event: self.blink._get_thumbnail(event.thumbnail+".jpg"), batch)
+            # a thumbnail that failed to download scores 1, the clip is kept
+            scores = self.changes.scan([(event.camera_id, content) for event, content, error in thumbnails])
+            for event, score in zip(batch, scores):
+                if score < self.changes.threshold:
+                    self.index.mark_skipped(event.id)
+                    self._count(skipped=1)
+                elif not self._put(self._downloads, event):
+                    return
+
+    def _download(self):
+        while not self._stop.is_set():
+            event = self._take(self._downloads, self._listed)
+            if event is None or self._stop.is_set():
+                return
+            if self.retention is not None and self.retention.expired(event):
+                self.index.mark_evicted(event.id)
+                self._count(evicted=1)
+                continue
+            try:
+                self._fetch(event)
+            except Exception:
+                # an interrupted download stays pending for the next run
+                if not self._stop.is_set():
+                    self.index.mark_failed(event.id)
+                    self._count(failed=1)
+
+    def _fetch(self, event):
+        '''
+          Streams the clip of event to the writer threads chunk by chunk, the index is
+          updated once it is committed
+        '''
+        from hashlib import sha256
+        checksum = sha256()
+
+        def stored(stored, error):
+            if error is not None:
+                # an interrupted download stays pending for the next run
+                if not self._stop.is_set():
+                    self.index.mark_failed(event.id)
+                    self._count(failed=1)
+            else:
+                self.index.mark_downloaded(event.id, stored.size, checksum.hexdigest(), stored.location)
+                self._count(downloaded=1, bytes=stored.size)
+                if self.retention is not None and self.retention.over_quota(self.index):
+                    self._enforce()
+
+        resp = self.blink._get(event.address, stream=True, priority=PRIORITY_BULK)
+        try:
+            resp.raise_for_status()
+            size = resp.headers.get('Content-Length')
+            stream = self.storage.open(self.blink.get_event_name_v2(event), event,
+                                       int(size) if size else None, callback=stored)
+            try:
+                for chunk in resp.iter_content(self.chunk_size):
+                    if self._stop.is_set():
+                        raise BlinkError('archive stopped')
+                    if self.bandwidth is not None:
+                        self.bandwidth.consume(len(chunk))
+                    checksum.update(chunk)
+                    if not stream.write(chunk):
+                        # writing failed, the callback reports it
+                        return
+            except BaseException as e:
+                stream.abort(e)
+                if not isinstance(e, Exception):
+                    raise
+                return
+            stream.close()
+        finally:
+            resp.close()
+
+###############################################################################
+##  Event Watcher
+###############################################################################
+
+class EventWatcher(object):
+    '''
+      Long running watcher of the new events of one or more accounts
+
+      One thread polls the first page of every account when it is due. An account that
+      just recorded motion is polled every min_interval seconds; every idle poll stretches
+      its interval by backoff, up to max_interval. Only the events newer than the last
+      seen id are built into Event objects, following the pages if more than one page is new.
+
+      New events are passed to callback(blink, event) or, without a callback, put as
+      (blink, event) into a bounded queue read with get(). A full queue holds the polling
+      until the consumer catches up.
+
+      With a ChangeDetector, the new events of a poll are scored oldest first against the
+      last delivered event of their camera; those scoring below its threshold are dropped
+      and only counted in unchanged.
+    '''
+
+    def __init__(self, clients, callback=None, queue_size=100, min_interval=5, max_interval=60,
+                 backoff=1.5, max_pages=10, changes=None):
+        '''
+          clients: Blink or list of Blink, one per account
+          callback: called with (blink, event) for every new event, oldest first
+          queue_size: bound of the queue of new events when there is no callback
+          max_pages: most pages read per poll after a burst of events
+          changes: ChangeDetector, keyed by (client index, camera id)
+        '''
+        if isinstance(clients, BlinkBase):
+            clients = [clients]
+        self.clients = list(clients)
+        self.callback = callback
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_pages = max_pages
+        self.changes = changes
+        self.polls = 0
+        self.delivered = 0
+        self.unchanged = 0
+        self.errors = []
+        self.events = queue.Queue(queue_size)
+        # per client: id of the newest event seen, None until the first poll, and poll interval
+        self._last_id = [None] * len(self.clients)
+        self._interval = [min_interval] * len(self.clients)
+        self._stop = ThreadEvent()
+        self._thread = None
+
+    def start(self):
+        '''
+          Starts polling in a daemon thread
+        '''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def get(self, timeout=None):
+        '''
+          Returns the next (blink, event) of the queue, None after timeout seconds
+        '''
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def run(self):
+        '''
+          Polls until stop() is called, in the calling thread
+          The first poll of every account only records its newest event.
+        '''
+        due = [(monotonic(), i) for i in range(len(self.clients))]
+        heapq.heapify(due)
+        while due and not self._stop.is_set():
+            when, i = heapq.heappop(due)
+            if self._stop.wait(max(0, when - monotonic())):
+                return
+            self.poll(i)
+            heapq.heappush(due, (monotonic() + self._interval[i], i))
+
+    def poll(self, i):
+        '''
+          Checks the account clients[i] once and delivers its new events
+          Returns the number of new events
+        '''
+        blink = self.clients[i]
+        self.polls += 1
+        try:
+            blink._connect_if_needed()
+            events = self._new_events(blink, self._last_id[i])
+        except Exception as e:
+            self.errors.append({'client': i, 'error': e, 'time': time()})
+            self._interval[i] = self.max_interval
+            return 0
+        if events:
+            self._interval[i] = self.min_interval
+        else:
+            self._interval[i] = min(self._interval[i] * self.backoff, self.max_interval)
+        if self._last_id[i] is None:
+            # the first poll sets the baseline, the events before it are not new
+            self._last_id[i] = events[0].id if events else 0
+            return 0
+        if events:
+            self._last_id[i] = events[0].id
+        new = events[::-1]
+        if self.changes is not None:
+            new = self._changed(i, new)
+        for event in new:
+            if not self._deliver(blink, event):
+                break
+        return len(events)
+
+    def _changed(self, i, events):
+        '''
+          Returns the events, oldest first, whose thumbnail changed
+        '''
+        blink = self.clients[i]
+        thumbnails = blink._fan_out(lambda event: blink._get_thumbnail(event.thumbnail+".jpg"), events)
+        scores = self.changes.scan([((i, event.camera_id), content) for event, content, error in thumbnails])
+        changed = [event for event, score in zip(events, scores) if score >= self.changes.threshold]
+        self.unchanged += len(events) - len(changed)
+        return changed
+
+    def _new_events(self, blink, last_id):
+        '''
+          Returns the events newer than last_id, newest first, or the newest one if last_id is None
+        '''
+        events = []
+        for pagenumber in range(self.max_pages):
+            page = blink._events_page(pagenumber)
+            if not page:
+                break
+            for event in page:
+                if last_id is not None and event['id'] <= last_id:
+                    return events
+                events.append(Event(**event))
+                if last_id is None:
+                    return events
+        return events
+
+    def _deliver(self, blink, event):
+        if self.callback is not None:
+            try:
+                self.callback(blink, event)
+            except Exception as e:
+                self.errors.append({'client': self.clients.index(blink), 'error': e, 'time': time()})
+            self.delivered += 1
+            return True
+        while not self._stop.is_set():
+            try:
+                self.events.put((blink, event), timeout=0.1)
+                self.delivered += 1
+                return True
+            except queue.Full:
+                pass
+        return False
+
+###############################################################################
+##  Fleet of accounts
+###############################################################################
+
+def _shard_worker(conn, accounts, options):
+    '''
+      Main loop of a worker process of a sharded BlinkFleet: keeps the clients of its shard
+      logged in between operations and runs every function it receives on them, until None
+    '''
+    fleet = BlinkFleet(accounts, **options)
+    try:
+        while True:
+            func = conn.recv()
+            if func is None:
+                return
+            try:
+                results = [(email, result, str(error) if error is not None else None)
+                           for email, result, error in fleet.run(func)]
+                conn.send(results)
+            except Exception as e:
+                conn.send([(email, None, str(e)) for email, password in accounts])
+    finally:
+        fleet.close()
+        conn.close()
+
+
+class BlinkFleet(object):
+    '''
+      Many accounts driven from one process
+
+      Every account has its own Blink with its own login and topology, but all of them
+      send through one pooled session and one global RequestScheduler. Each account
+      also has its own scheduler, limiting its share of the global one.
+
+      Fleet-wide operations call a function on all accounts concurrently, at most
+      max_workers accounts at a time, and return (email, result, error) tuples. With
+      processes > 1 the accounts are sharded across long-lived worker processes instead,
+      for when parsing or checksumming uses up one CPU. Every worker keeps the clients of
+      its shard between operations and gets an equal part of rate_limit, burst,
+      max_inflight and pool_maxsize, so the limits still hold for the fleet as a whole.
+      The function then has to be picklable, e.g. a module level function, its results
+      have to be picklable and errors are passed back as strings, as are the Blink options.
+      The workers are spawned, not forked. The clients live in the workers, clients stays empty.
+    '''
+
+    def __init__(self, accounts, pool_connections=10, pool_maxsize=100, rate_limit=None, burst=None,
+                 max_inflight=64, account_rate_limit=10, account_burst=20, account_inflight=4,
+                 max_workers=16, processes=0, **options):
+        '''
+          accounts: (email, password) pairs
+          rate_limit, burst, max_inflight: limits of all accounts together
+          account_rate_limit, account_burst, account_inflight: limits of every account
+          max_workers: number of accounts handled concurrently by fleet operations
+          processes: number of worker processes, 0 or 1 runs in this process
+          options: further Blink options, e.g. session_cache
+        '''
+        self.accounts = list(accounts)
+        self.processes = min(processes, len(self.accounts)) if processes > 1 else 0
+        self.max_workers = max_workers
+        shards = max(1, self.processes)
+        self._shard_options = dict(options, pool_connections=pool_connections,
+                                   pool_maxsize=max(1, pool_maxsize // shards),
+                                   rate_limit=rate_limit / float(shards) if rate_limit else rate_limit,
+                                   burst=max(1, burst // shards) if burst else burst,
+                                   max_inflight=max(1, max_inflight // shards),
+                                   account_rate_limit=account_rate_limit, account_burst=account_burst,
+                                   account_inflight=account_inflight, max_workers=max_workers)
+        self._workers = []
+        from requests.compat import cookielib
+        self.session = pooled_session(pool_connections, pool_maxsize)
+        # the accounts share the session, so its jar would pass the cookies of one account to all of them;
+        # the API authenticates with the token header, no cookie is kept
+        self.session.cookies.set_policy(cookielib.DefaultCookiePolicy(allowed_domains=[]))
+        self.scheduler = RequestScheduler(rate_limit, burst, max_inflight)
+        self.clients = []
+        for email, password in self.accounts if not self.processes else []:
+            scheduler = RequestScheduler(account_rate_limit, account_burst, account_inflight, parent=self.scheduler)
+            self.clients.append(Blink(email, password, session=self.session, scheduler=scheduler, **options))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for process, conn in self._workers:
+            try:
+                conn.send(None)
+            except (EOFError, OSError):
+                pass
+        for process, conn in self._workers:
+            process.join()
+            conn.close()
+        self._workers = []
+        self.session.close()
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __getitem__(self, email):
+        for client in self.clients:
+            if client._email == email:
+                return client
+        raise KeyError(email)
+
+    def run(self, func):
+        '''
+          Calls func(blink) for every account
+          Returns (email, result, error) tuples in the order of the accounts
+        '''
+        if self.processes:
+            return self._run_sharded(func)
+        from concurrent.futures import ThreadPoolExecutor
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(self.clients)))) as pool:
+            futures = [pool.submit(func, client) for client in self.clients]
+            for client, future in zip(self.clients, futures):
+                try:
+                    results.append((client._email, future.result(), None))
+                except Exception as e:
+                    results.append((client._email, None, e))
+        return results
+
+    def _run_sharded(self, func):
+        import multiprocessing
+        if not self._workers:
+            # forking a process that runs threads may copy locks held by them
+            context = multiprocessing.get_context('spawn')
+            for i in range(self.processes):
+                conn, child = context.Pipe()
+                process = context.Process(target=_shard_worker,
+                                                  args=(child, self.accounts[i::self.processes], self._shard_options))
+                process.daemon = True
+                process.start()
+                child.close()
+                self._workers.append((process, conn))
+        for process, conn in self._workers:
+            conn.send(func)
+        results = {}
+        for process, conn in self._workers:
+            for email, result, error in conn.recv():
+                results[email] = (email, result, error)
+        return [results[email] for email, password in self.accounts]
+
+    def connect(self):
+        '''
+          Connects all accounts, returns the errors of the ones that failed by email
+        '''
+        return self._errors(self.run(_connect))
+
+    def _errors(self, results):
+        return dict((email, error) for email, result, error in results if error is not None)
+
+    def get_camera_sensor_info(self):
+        '''
+          Returns the sensor info of the cameras of all accounts, with an email key added
+          Accounts that failed are listed as entries with an error key
+        '''
+        return self._flatten(self.run(_camera_sensor_info))
+
+    def list_camera_ids(self):
+        '''
+          Returns the camera ids of every account by email
+          Accounts that failed map to a dict with an error key
+        '''
+        return dict((email, result if error is None else {'error': str(error)})
+                    for email, result, error in self.run(_list_camera_ids))
+
+    def sync(self, path):
+        '''
+          Syncs the EventIndex path/<email>.db of every account
+          Returns the newly indexed events of all accounts, with an email key added
+          Accounts that failed are listed as entries with an error key
+        '''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return self._flatten(self.run(_IndexSync(path)))
+
+    def _flatten(self, results):
+        entries = []
+        for email, result, error in results:
+            if error is not None:
+                entries.append({'email': email, 'error': str(error)})
+                continue
+            for entry in result:
+                entry = dict(entry)
+                entry['email'] = email
+                entries.append(entry)
+        return entries
+
+
+# fleet operations are module level, so sharded runs can pickle them
+def _connect(blink):
+    blink.connect()
+
+def _camera_sensor_info(blink):
+    return blink.get_camera_sensor_info()
+
+def _list_camera_ids(blink):
+    return blink.list_camera_ids()
+
+class _IndexSync(object):
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, blink):
+        index = EventIndex(os.path.join(self.path, blink._email + '.db'))
+        try:
+            return [event.to_dict() for event in blink.sync(index)]
+        finally:
+            index.close()
@@ -0,0 +1,333 @@
+'''
+  asyncio client for the Blink API, requires python 3 and aiohttp
+
+    async with AsyncBlink(email, password) as b:
+        await b.login()
+        events = await b.eventsv2()
+'''
+import asyncio
+import aiohttp
+
+from blink import BlinkBase, Camera, Event, SyncModule, json_loads
+
+###############################################################################
+##  Async Blink API
+###############################################################################
+
+class AsyncBlink(BlinkBase):
+
+    def __init__(self, email, password, server='immedia-semi.com',
+                 limit=100, limit_per_host=10, timeout=30, max_workers=8, base_url=None):
+        '''
+          limit: maximum number of open connections
+          limit_per_host: maximum number of open connections per host
+          timeout: seconds to wait for a whole request
+          max_workers: maximum number of concurrent requests of the multi-camera sweeps
+          base_url: send all requests to this URL instead of the region host
+        '''
+        BlinkBase.__init__(self, email, password, server, timeout, max_workers, base_url)
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._session = None
+        # created on first use, as it has to belong to the running event loop
+        self._login_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+###############################################################################
+##  Common
+###############################################################################
+    @property
+    def session(self):
+        '''
+          The pooled keep-alive session all requests go through, created on first use
+          as it has to belong to the running event loop
+          It carries no auth token, so a login never has to replace it under requests in flight.
+        '''
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._limit, limit_per_host=self._limit_per_host)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self._timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _connect_if_needed(self):
+        if not self._authtoken:
+            async with self._lock():
+                # concurrent first calls wait for the login of the first one
+                if not self._authtoken:
+                    await self._login()
+        if not self.connected: raise Exception('Unable to connect.')
+
+    def _lock(self):
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        return self._login_lock
+
+    def _headers(self, headers=None):
+        '''
+          Returns headers with the auth token of the current login added
+        '''
+        if not self._authtoken:
+            return headers
+        merged = dict(self._auth_headers)
+        merged.update(headers or {})
+        return merged
+
+    async def _request(self, method, path, headers=None, **kwargs):
+        '''
+          Returns the status and the raw body of the response
+        '''
+        async with self.session.request(method, self._path(path), headers=self._headers(headers), **kwargs) as resp:
+            return resp.status, await resp.read()
+
+    async def _get_json(self, path):
+        status, content = await self._request('GET', path)
+        return json_loads(content)
+
+    async def _post_json(self, path, **kwargs):
+        status, content = await self._request('POST', path, **kwargs)
+        return json_loads(content)
+
+    async def _get_content(self, path):
+        status, content = await self._request('GET', path)
+        return content
+
+    async def _fan_out(self, func, items):
+        '''
+          Awaits func(item) for every item, at most max_workers at a time
+          Returns (item, result, error) tuples in the order of items
+        '''
+        items = list(items)
+        semaphore = asyncio.Semaphore(max(1, self._max_workers))
+
+        async def run(item):
+            async with semaphore:
+                return await func(item)
+
+        results = await asyncio.gather(*[run(item) for item in items], return_exceptions=True)
+        return [(item, None, result) if isinstance(result, Exception) else (item, result, None)
+                for item, result in zip(items, results)]
+
+    async def _onboarded_networks(self):
+        return self._filter_onboarded(await self._get_json("networks"))
+
+    async def _network_cameras(self, network):
+        resp = await self._get_json("network/"+str(network['id'])+"/cameras")
+        return resp['devicestatus']
+
+    async def _all_cameras(self):
+        pairs = []
+        for network, cameras, error in await self._fan_out(self._network_cameras, await self._onboarded_networks()):
+            if error is not None:
+                self.sweep_errors.append({'network_id': network['id'], 'camera_id': None, 'error': error})
+                continue
+            pairs.extend((network, camera) for camera in cameras)
+        return pairs
+
+    async def _sweep_cameras(self, func):
+        self.sweep_errors = []
+        results = []
+        for (network, camera), result, error in await self._fan_out(lambda pair: func(*pair), await self._all_cameras()):
+            if error is not None:
+                self.sweep_errors.append({'network_id': network['id'], 'camera_id': camera['camera_id'], 'error': error})
+            results.append((network, camera, result, error))
+        return results
+
+###############################################################################
+##  Highlighted Client APIs
+###############################################################################
+    async def login(self):
+        async with self._lock():
+            await self._login()
+
+    async def _login(self):
+        headers, data = self._login_request()
+        async with self.session.post(self._path('login'), json=data, headers=headers) as resp:
+            raw = json_loads(await resp.read())
+            if resp.status!=200:
+                raise Exception(raw['message'])
+        # requests pick up the new token and region host, the pool stays open for the ones in flight
+        self._load_login(raw)
+
+    async def cameras(self, network, type='motion'):
+        await self._connect_if_needed()
+        resp = await self._get_json('network/%s/cameras' % network.id)
+        return [Camera(**camera) for camera in resp['devicestatus']]
+
+    async def homescreen(self):
+        '''
+        Return information displayed on the home screen of the mobile client
+        '''
+        await self._connect_if_needed()
+        return await self._get_json('homescreen')
+
+    async def download_thumbnail_event_v2(self, event):
+        await self._connect_if_needed()
+        return await self._get_content(event.thumbnail+".jpg")
+
+    async def download_thumbnail_home_v2(self, device):
+        await self._connect_if_needed()
+        content = await self._get_content(device['thumbnail']+".jpg")
+        return content, self.get_thumbnail_name_device(device)
+
+    async def eventsv2(self, pagenumber = 0):
+        await self._connect_if_needed()
+        events = await self._get_json('api/v2/videos/page/'+str(pagenumber))
+        return [Event(**event) for event in events]
+
+    async def get_video_count(self):
+        await self._connect_if_needed()
+        resp = await self._get_json('api/v2/videos/count')
+        return resp['count']
+
+    async def download_video_v2(self, event):
+        await self._connect_if_needed()
+        return await self._get_content(event.address)
+
+###############################################################################
+##  Wrapped Functions
+###############################################################################
+    async def list_network_ids(self):
+        await self._connect_if_needed()
+        return [network['id'] for network in await self._onboarded_networks()]
+
+    async def list_camera_ids(self):
+        await self._connect_if_needed()
+        self.sweep_errors = []
+        return [camera['camera_id'] for network, camera in await self._all_cameras()]
+
+    async def refresh_all_cameras_thumbnail(self, timeout=30):
+        '''
+          Refresh all cameras with lastest thumbnails
+          Returns the completion status of every camera, see Blink.wait_for_commands
+        '''
+        await self._connect_if_needed()
+        return await self._refresh_all_cameras('thumbnail', timeout)
+
+    async def refresh_all_cameras_video(self, timeout=60):
+        '''
+          Refresh all cameras with lastest videos
+          Returns the completion status of every camera, see Blink.wait_for_commands
+        '''
+        await self._connect_if_needed()
+        return await self._refresh_all_cameras('clip', timeout)
+
+    async def _refresh_all_cameras(self, command, timeout):
+        loop = asyncio.get_event_loop()
+
+        async def refresh(network, camera):
+            issued = loop.time()
+            return issued, await self._post_json("network/"+str(network['id'])+"/camera/"+str(camera['camera_id'])+"/"+command)
+
+        results = []
+        for network, camera, issued, error in await self._sweep_cameras(refresh):
+            result = {'network_id': network['id'], 'camera_id': camera['camera_id'], 'command_id': None,
+                      'complete': False, 'status': None, 'latency': None, 'error': None}
+            if error is not None:
+                result['error'] = str(error)
+            else:
+                result['issued'], resp = issued
+                result['command_id'] = resp.get('id')
+                if result['command_id'] is None:
+                    result['error'] = resp.get('message', 'no command id')
+            results.append(result)
+        await self.wait_for_commands([r for r in results if r['command_id'] is not None], timeout)
+        return results
+
+    async def wait_for_commands(self, commands, timeout=30, interval=0.25, max_interval=2.0):
+        '''
+          Polls the status of commands concurrently until each completes or timeout seconds passed
+          Same as Blink.wait_for_commands, issued times are taken from the event loop clock.
+        '''
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+
+        async def poll(command):
+            command.setdefault('issued', loop.time())
+            command['complete'] = False
+            delay = interval
+            due = command['issued'] + interval
+            while True:
+                await asyncio.sleep(max(0, min(due, deadline) - loop.time()))
+                if loop.time() >= deadline:
+                    return
+                try:
+                    status = await self._get_json('network/%s/command/%s' % (command['network_id'], command['command_id']))
+                except Exception:
+                    status = {}
+                if status.get('complete'):
+                    command['complete'] = True
+                    command['status'] = status.get('status')
+                    command['latency'] = loop.time() - command['issued']
+                    return
+                delay = min(delay * 1.5, max_interval)
+                due = loop.time() + delay
+
+        await asyncio.gather(*[poll(command) for command in commands])
+        return commands
+
+    async def get_camera_info(self):
+        await self._connect_if_needed()
+
+        async def camera_info(network, camera):
+            return await self._get_json("network/"+str(network['id'])+"/camera/"+str(camera['camera_id']))
+
+        cameraInfos = []
+        for network, camera, cameraInfo, error in await self._sweep_cameras(camera_info):
+            if error is not None:
+                cameraInfo = self._sweep_error_info(network, camera, error)
+            cameraInfos.append(cameraInfo)
+        return cameraInfos
+
+    async def get_camera_sensor_info(self):
+        await self._connect_if_needed()
+
+        async def camera_sensor_info(network, camera):
+            return await self._get_json("network/"+str(network['id'])+"/camera/"+str(camera['camera_id'])+"/signals")
+
+        cameraSensorInfos = []
+        for network, camera, cameraSensorInfo, error in await self._sweep_cameras(camera_sensor_info):
+            if error is not None:
+                cameraSensorInfo = self._sweep_error_info(network, camera, error)
+            cameraSensorInfo['network_id'] = network['id']
+            cameraSensorInfo['camera_id'] = camera['camera_id']
+            cameraSensorInfos.append(cameraSensorInfo)
+        return cameraSensorInfos
+
+###############################################################################
+##  Other Client APIs
+###############################################################################
+    async def sync_modules(self, network):
+        await self._connect_if_needed()
+        resp = await self._get_json('network/%s/syncmodules' % network.id)
+        return [SyncModule(**resp['syncmodule'])]
+
+    async def arm(self, network):
+        '''
+          Arm the given network (start recording/reporting motion events)
+        '''
+        await self._connect_if_needed()
+        return await self._post_json('network/%s/arm' % network.id)
+
+    async def disarm(self, network):
+        '''
+          Disarm the given network (stop recording/reporting motion events)
+        '''
+        await self._connect_if_needed()
+        return await self._post_json('network/%s/disarm' % network.id)
+
+    async def command_status(self, network, command_id):
+        '''
+          Get status info on the given command
+        '''
+        await self._connect_if_needed()
+        return await self._get_json('network/%s/command/%s' % (network.id, command_id))
@@ -1,15 +1,21 @@
 import os, argparse
+from datetime import datetime, timedelta, timezone
 import blink
 
 if __name__=='__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--email', dest='email', type=str, help='email')
     parser.add_argument('--password', dest='password', type=str, help='password')
+    parser.add_argument('--session-cache', dest='session_cache', type=str, help='file to reuse the login of previous runs')
+    parser.add_argument('--max-gb', dest='max_gb', type=float, help='disk quota of the downloaded events')
+    parser.add_argument('--keep-days', dest='keep_days', type=float, help='days the downloaded events are kept')
+    parser.add_argument('--first-days', dest='first_days', type=float, default=1,
+                        help='days of history downloaded by the first run, 0 for all of it')
 
     args = parser.parse_args()
 
-    b = blink.Blink(email=args.email, password=args.password)
-    b.login()
+    b = blink.Blink(email=args.email, password=args.password, session_cache=args.session_cache)
+    b.connect()
 
     ## Show all network IDs
     networksids = b.list_network_ids()
@@ -36,13 +42,19 @@ if __name__=='__main__':
             blink.save_to_file(content, filename)
             print("Download latest thumbnails to " + filename)
 
-    # Download latest events from all cameras
-    print("Download latest events from all cameras")
-    events = b.eventsv2()
-    for event in events:
-        content = b.download_video_v2(event)
-        filename = b.get_event_name_v2(event)
-        blink.save_to_file(content, filename)
+    # Download the events from all cameras recorded since the last run, or the last day on the first run
+    print("Download new events from all cameras")
+    index = blink.EventIndex('events.db')
+    retention = blink.RetentionPolicy(max_bytes=args.max_gb*1024**3 if args.max_gb else None, max_age=args.keep_days)
+    b.sync(index, since=datetime.now(timezone.utc) - timedelta(days=args.first_days) if args.first_days else None)
+    for row in index.pending():
+        event = blink.Event(**row)
+        if retention.expired(event):
+            index.mark_evicted(event.id)
+            continue
+        filename, size = b.download_video_v2_to_file(event)
+        index.mark_downloaded(event.id, size, blink.file_checksum(filename), filename)
+    print(retention.enforce(index))
 
     # Download latest events from one camera
     print("Download latest events from one camera")
@@ -51,7 +63,6 @@ if __name__=='__main__':
         # Download at most 5 event from this camera
         events = b.events_from_camera(id, 5)
         for event in events:
-            content = b.download_video_v2(event)
             filename = b.get_event_name_v2(event)
-            blink.save_to_file(content, str(id) + "_" + filename)
+            b.download_video_v2_to_file(event, str(id) + "_" + filename)
             
\ No newline at end of file
@@ -0,0 +1,400 @@
+'''
+  Local stand-in for the Blink REST API, for offline tests and benchmarks, requires python 3
+
+    with MockServer(networks=2, cameras=4, videos=500, latency=0.02) as server:
+        b = blink.Blink('user@example.com', 'secret', base_url=server.url)
+        b.list_all_events()
+
+  It serves the endpoints blink.py uses from a generated account: login, networks,
+  cameras, camera info and signals, refresh commands and their status, homescreen,
+  event pages, clip and thumbnail downloads (with Range and ETag support), arm, disarm
+  and deletions. Latency, bandwidth and a random error rate can be set.
+
+  Run it standalone with
+    python mockserver.py --port 8080 --videos 1000 --latency 0.05
+'''
+import json, random, re, threading, time, zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+###############################################################################
+##  Account
+###############################################################################
+
+class MockAccount(object):
+    '''
+      The networks, cameras and events served by a MockServer
+      Events are numbered from 1, the newest has the highest id, and are spread over
+      the cameras one every interval seconds back from now.
+    '''
+
+    def __init__(self, networks=1, cameras=3, videos=100, video_size=256*1024, thumbnail_size=8*1024,
+                 interval=600):
+        self.video_size = video_size
+        self.thumbnail_size = thumbnail_size
+        self.interval = interval
+        self.networks = [{'id': 1000 + n, 'name': 'Network %d' % n} for n in range(networks)]
+        self.cameras = []
+        for network in self.networks:
+            for c in range(cameras):
+                camera_id = network['id'] * 100 + c
+                self.cameras.append({'id': camera_id, 'camera_id': camera_id, 'network_id': network['id'],
+                                     'name': 'Camera %d' % camera_id, 'device_type': 'camera', 'enabled': True,
+                                     'active': 'armed', 'thumbnail': '/media/thumbnails/camera_%d' % camera_id})
+        self.events = []
+        self._lock = threading.Lock()
+        self._now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.add_events(videos, start=self._now - timedelta(seconds=interval * videos))
+
+    def add_events(self, count, start=None):
+        '''
+          Records count new events, as if the cameras saw motion
+        '''
+        with self._lock:
+            if start is None:
+                start = max(self._now, datetime.now(timezone.utc).replace(microsecond=0))
+            first = self.events[0]['id'] + 1 if self.events else 1
+            for i in range(count):
+                id = first + i
+                camera = self.cameras[id % len(self.cameras)]
+                network = [n for n in self.networks if n['id'] == camera['network_id']][0]
+                created_at = start + timedelta(seconds=self.interval * (i + 1))
+                self._now = max(self._now, created_at)
+                self.events.insert(0, {
+                    'id': id, 'camera_id': camera['camera_id'], 'camera_name': camera['name'],
+                    'network_id': network['id'], 'network_name': network['name'],
+                    'address': '/api/v2/media/clip_%d.mp4' % id,
+                    'thumbnail': '/api/v2/media/clip_%d' % id,
+                    'length': 30, 'watched': False, 'partial': False, 'deleted': False, 'type': 'motion',
+                    'created_at': created_at.isoformat(), 'updated_at': created_at.isoformat()})
+
+    def page(self, pagenumber, page_size, unwatched=False):
+        with self._lock:
+            events = [e for e in self.events if not e['watched']] if unwatched else self.events
+            return events[pagenumber * page_size:(pagenumber + 1) * page_size]
+
+    def event(self, id):
+        with self._lock:
+            for event in self.events:
+                if event['id'] == id:
+                    return event
+        return None
+
+    def delete(self, id):
+        with self._lock:
+            before = len(self.events)
+            self.events = [e for e in self.events if e['id'] != id]
+            return len(self.events) < before
+
+    def content(self, key, size):
+        '''
+          Returns size bytes of content that only depend on key
+        '''
+        pattern = (key + '|').encode()
+        return (pattern * (size // len(pattern) + 1))[:size]
+
+###############################################################################
+##  Server
+###############################################################################
+
+class MockServer(object):
+    '''
+      latency: seconds every request waits before it is answered
+      bandwidth: bytes per second each response body is sent with, None for unlimited
+      error_rate: share of requests answered with error_status instead
+      command_delay: seconds a refresh command takes to complete
+      page_size: events per page
+      password: the only accepted password, None accepts any
+      Further keyword arguments are passed to MockAccount.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, bandwidth=None, error_rate=0, error_status=503,
+                 command_delay=0.5, page_size=25, password=None, account=None, **kwargs):
+        self.account = account or MockAccount(**kwargs)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.command_delay = command_delay
+        self.page_size = page_size
+        self.password = password
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._tokens = set()
+        self._commands = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(1)
+        self._httpd = _HTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def _fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def login(self, body):
+        if self.password is not None and body.get('password') != self.password:
+            return 401, {'message': 'Invalid credentials'}
+        with self._lock:
+            token = 'mock-%016x' % self._random.getrandbits(64)
+            self._tokens.add(token)
+        networks = dict((str(n['id']), {'name': n['name'], 'onboarded': True}) for n in self.account.networks)
+        return 200, {'networks': networks, 'region': {'mock': 'Mock'},
+                     'authtoken': {'authtoken': token, 'message': 'auth'}}
+
+    def authorized(self, token):
+        with self._lock:
+            return token in self._tokens
+
+    def revoke(self):
+        '''
+          Invalidates all auth tokens, the clients have to log in again
+        '''
+        with self._lock:
+            self._tokens.clear()
+
+    def issue_command(self, network_id, command):
+        with self._lock:
+            command_id = len(self._commands) + 1
+            self._commands[command_id] = time.time() + self.command_delay
+        return {'id': command_id, 'network_id': network_id, 'command': command, 'state': 'new'}
+
+    def command_status(self, command_id):
+        with self._lock:
+            due = self._commands.get(command_id)
+        if due is None:
+            return 404, {'message': 'Command not found'}
+        complete = time.time() >= due
+        return 200, {'id': command_id, 'complete': complete, 'status': 0 if complete else None,
+                     'status_msg': 'Command succeeded' if complete else 'Command in progress'}
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients dropping a connection mid-response, e.g. a stopped archive, are expected
+        import sys
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without this every keep-alive
+    # response would wait for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    routes = [
+        ('POST', r'/login$', 'login'),
+        ('GET', r'/networks$', 'networks'),
+        ('GET', r'/network/(\d+)/cameras$', 'cameras'),
+        ('GET', r'/network/(\d+)/camera/(\d+)$', 'camera'),
+        ('GET', r'/network/(\d+)/camera/(\d+)/signals$', 'signals'),
+        ('POST', r'/network/(\d+)/camera/(\d+)/(thumbnail|clip)$', 'refresh'),
+        ('GET', r'/network/(\d+)/command/(\d+)$', 'command'),
+        ('GET', r'/network/(\d+)/syncmodules$', 'syncmodules'),
+        ('POST', r'/network/(\d+)/(arm|disarm)$', 'arm'),
+        ('GET', r'/homescreen$', 'homescreen'),
+        ('GET', r'/api/v2/videos/count$', 'count'),
+        ('GET', r'/api/v2/videos/page/(\d+)$', 'page'),
+        ('GET', r'/api/v2/videos/unwatched/page/(\d+)$', 'unwatched'),
+        ('GET', r'/api/v2/video/(\d+)$', 'video_info'),
+        ('POST', r'/api/v2/video/(\d+)/delete$', 'delete'),
+        ('GET', r'/account/clients$', 'clients'),
+        ('GET', r'/regions$', 'regions'),
+        ('GET', r'/.*\.mp4$', 'clip'),
+        ('GET', r'/.*\.jpg$', 'thumbnail'),
+    ]
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.mock._count(requests=1)
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        path = self.path.split('?')[0]
+        if self.mock._fail():
+            self.mock._count(errors=1)
+            return self._json(self.mock.error_status, {'message': 'Injected error'})
+        for route_method, pattern, name in self.routes:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                if name != 'login' and not self.mock.authorized(self.headers.get('TOKEN_AUTH')):
+                    return self._json(401, {'message': 'Unauthorized Access', 'code': 101})
+                args = [int(arg) if arg.isdigit() else arg for arg in match.groups()]
+                if name == 'login':
+                    args = [json.loads(body.decode() or '{}')]
+                return getattr(self, 'handle_' + name)(*args)
+        self._json(404, {'message': 'Not found'})
+
+    def _send(self, status, content, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        bandwidth = self.mock.bandwidth
+        chunk_size = 64 * 1024
+        for offset in range(0, len(content), chunk_size):
+            chunk = content[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            if bandwidth:
+                time.sleep(float(len(chunk)) / bandwidth)
+        self.mock._count(bytes_sent=len(content))
+
+    def _json(self, status, data):
+        self._send(status, json.dumps(data).encode(), 'application/json')
+
+    def handle_login(self, body):
+        status, data = self.mock.login(body)
+        # like a real server, the login answer sets a cookie, which clients have to keep per account
+        headers = {'Set-Cookie': 'session=%s; Path=/' % data['authtoken']['authtoken']} if status == 200 else None
+        self._send(status, json.dumps(data).encode(), 'application/json', headers)
+
+    def handle_networks(self):
+        networks = self.mock.account.networks
+        self._json(200, {'networks': networks,
+                         'summary': dict((str(n['id']), {'name': n['name'], 'onboarded': True}) for n in networks)})
+
+    def _cameras(self, network_id):
+        return [c for c in self.mock.account.cameras if c['network_id'] == network_id]
+
+    def handle_cameras(self, network_id):
+        self._json(200, {'devicestatus': self._cameras(network_id)})
+
+    def handle_camera(self, network_id, camera_id):
+        self._json(200, {'camera': [c for c in self._cameras(network_id) if c['camera_id'] == camera_id]})
+
+    def handle_signals(self, network_id, camera_id):
+        self._json(200, {'lfr': 5, 'wifi': 4, 'temp': 68, 'battery': 3})
+
+    def handle_refresh(self, network_id, camera_id, command):
+        self._json(200, self.mock.issue_command(network_id, command))
+
+    def handle_command(self, network_id, command_id):
+        self._json(*self.mock.command_status(command_id))
+
+    def handle_syncmodules(self, network_id):
+        self._json(200, {'syncmodule': {'id': network_id * 10, 'network_id': network_id, 'name': 'Sync Module',
+                                        'serial': '%09d' % network_id, 'status': 'online', 'onboarded': True}})
+
+    def handle_arm(self, network_id, command):
+        self._json(200, self.mock.issue_command(network_id, command))
+
+    def handle_homescreen(self):
+        account = self.mock.account
+        self._json(200, {'account': {'notifications': 0}, 'network': {'armed': True},
+                         'devices': [dict(camera, device_id=camera['camera_id']) for camera in account.cameras]})
+
+    def handle_count(self):
+        self._json(200, {'count': len(self.mock.account.events)})
+
+    def handle_page(self, pagenumber):
+        self._json(200, self.mock.account.page(pagenumber, self.mock.page_size))
+
+    def handle_unwatched(self, pagenumber):
+        self._json(200, self.mock.account.page(pagenumber, self.mock.page_size, unwatched=True))
+
+    def handle_video_info(self, id):
+        event = self.mock.account.event(id)
+        self._json(200, event) if event is not None else self._json(404, {'message': 'Not found'})
+
+    def handle_delete(self, id):
+        if self.mock.account.delete(id):
+            self._json(200, {'code': 704, 'message': 'Video Deleted'})
+        else:
+            self._json(200, {'code': 700, 'message': 'Video not found'})
+
+    def handle_clients(self):
+        self._json(200, {'clients': {}})
+
+    def handle_regions(self):
+        self._json(200, {'preferred': 'mock', 'regions': {'mock': {'display_order': 1, 'dns': 'mock'}}})
+
+    def handle_clip(self):
+        account = self.mock.account
+        content = account.content(self.path, account.video_size)
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            if start >= len(content):
+                return self._send(416, b'', 'video/mp4', {'Content-Range': 'bytes */%d' % len(content)})
+            return self._send(206, content[start:], 'video/mp4',
+                              {'Content-Range': 'bytes %d-%d/%d' % (start, len(content) - 1, len(content))})
+        self._send(200, content, 'video/mp4')
+
+    def handle_thumbnail(self):
+        account = self.mock.account
+        etag = '"%08x"' % zlib.crc32(self.path.encode())
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, b'', 'image/jpeg', {'ETag': etag})
+        self._send(200, account.content(self.path, account.thumbnail_size), 'image/jpeg', {'ETag': etag})
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--networks', type=int, default=1)
+    parser.add_argument('--cameras', type=int, default=3, help='cameras per network')
+    parser.add_argument('--videos', type=int, default=100)
+    parser.add_argument('--video-size', dest='video_size', type=int, default=256*1024)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--bandwidth', type=int, default=None, help='bytes per second per response')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0)
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, latency=args.latency, bandwidth=args.bandwidth,
+                        error_rate=args.error_rate, networks=args.networks, cameras=args.cameras,
+                        videos=args.videos, video_size=args.video_size)
+    print('Serving a mock Blink account on ' + server.url)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,24 +1,66 @@
-import sys, json, unittest
+import operator, os, pickle, shutil, subprocess, sys, json, tempfile, threading, time, unittest
 import blink
 from blink import Blink
 
 ###############################################################################
 ##  Unittests for Blink Client APIs
 ###############################################################################
+SESSION_CACHE = os.path.join(tempfile.gettempdir(), 'blink_unittests_session.json')
+
 class TestBlink(unittest.TestCase):
     email = ""
     password = ""
+    # extra Blink options, TestBlinkOffline points the clients at a mock server
+    options = {}
 
     def setUp(self):
-        self.b = Blink(self.email, self.password)
-        self.b.login()
+        self.b = Blink(self.email, self.password, session_cache=SESSION_CACHE, **self.options)
+        self.b.connect()
 
 ###############################################################################
 ##  Highlighted Client APIs
 ###############################################################################
     def test_login(self):
+        self.b.login()
         self.assertTrue(self.b.connected)
 
+    def test_session_cache(self):
+        b = Blink(self.email, self.password, session_cache=SESSION_CACHE, **self.options)
+        b.connect()
+        self.assertEqual(b._authtoken, self.b._authtoken)
+        self.assertEqual([n.id for n in b.networks], [n.id for n in self.b.networks])
+        self.assertEqual(b.get_video_count(), self.b.get_video_count())
+
+    def test_session(self):
+        session = self.b.session
+        self.assertTrue(session.headers['TOKEN_AUTH'] is not None)
+        self.b.homescreen()
+        self.assertTrue(self.b.session is session)
+
+    def test_concurrent_login(self):
+        b = Blink(self.email, self.password, **self.options)
+        requests = []
+        b.on_request_end.append(requests.append)
+        threads = [threading.Thread(target=b.homescreen) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([info.path for info in requests].count('login'), 1)
+        self.assertEqual([info.error for info in requests], [None] * len(requests))
+
+    def test_coalesced_reads(self):
+        b = Blink(self.email, self.password, session_cache=SESSION_CACHE, coalesce_ttl=60, **self.options)
+        b.connect()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(b.homescreen())) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(b.coalesced, 3)
+
     def test_homescreen(self):
         data = self.b.homescreen()
         self.assertTrue(data['account'] is not None)
@@ -32,6 +74,21 @@ class TestBlink(unittest.TestCase):
         events = self.b.eventsv2()
         self.assertEqual(type(events), list)
 
+    def test_event_batch(self):
+        events = self.b.eventsv2()
+        if len(events) == 0:
+            return ;
+        batch = blink.EventBatch(events)
+        selected = batch.select(camera_id=events[0].camera_id, since=events[-1].created_at)
+        self.assertEqual(list(selected), [e for e in events if e.camera_id == events[0].camera_id])
+        self.assertEqual(events[0].created_at.tzinfo is not None, True)
+
+    def test_streaming_parse(self):
+        self.assertEqual([e.id for e in self.b.iter_eventsv2()], [e.id for e in self.b.eventsv2()])
+        self.assertEqual(list(self.b.iter_homescreen_devices()), self.b.homescreen()['devices'])
+        chunks = [b'{"account": {"id": 1}, "devi', b'ces": [{"id": 1', b'2}, 3', b'4]}']
+        self.assertEqual(list(blink.iter_json_items(chunks, 'devices')), [{'id': 12}, 34])
+
     def test_video_count(self):
         count = self.b.get_video_count()
         print("video count = " + str(count))
@@ -45,6 +102,32 @@ class TestBlink(unittest.TestCase):
         filename = self.b.get_event_name_v2(event)
         blink.save_to_file(content, "event_"+filename)
 
+    def test_events_v2_download_to_file(self):
+        events = self.b.eventsv2()
+        if len(events) == 0:
+            return ;
+        event = events[0]
+        filename, size = self.b.download_video_v2_to_file(event, "stream_"+self.b.get_event_name_v2(event))
+        self.assertEqual(size, len(self.b.download_video_v2(event)))
+        self.assertFalse(os.path.exists(filename + '.part'))
+
+    def test_events_v2_download_resume(self):
+        events = self.b.eventsv2()
+        if len(events) == 0:
+            return ;
+        event = events[0]
+        content = self.b.download_video_v2(event)
+        filename = "resume_"+self.b.get_event_name_v2(event)
+        # an earlier transfer stopped halfway
+        with open(filename + '.part', 'wb') as f:
+            f.write(content[:len(content) // 2])
+        requests = []
+        self.b.on_request_end.append(requests.append)
+        self.assertEqual(self.b.download_video_v2_to_file(event, filename), (filename, len(content)))
+        self.assertEqual([(info.status, info.bytes) for info in requests], [(206, len(content) - len(content) // 2)])
+        with open(filename, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
     def test_thumbnail_event_v2_download(self):
         events = self.b.eventsv2()
         if len(events) == 0:
@@ -57,6 +140,61 @@ class TestBlink(unittest.TestCase):
         f.close()
         print('Save downloaded image to ' + filename)
 
+    def test_thumbnail_cache(self):
+        path = tempfile.mkdtemp()
+        b = Blink(self.email, self.password, session_cache=SESSION_CACHE, thumbnail_cache=path, **self.options)
+        b.connect()
+        devices = [d for d in b.homescreen()['devices'] if d['device_type'] == "camera"]
+        first = [b.download_thumbnail_home_v2(device) for device in devices]
+        self.assertEqual([b.download_thumbnail_home_v2(device) for device in devices], first)
+        stats = b.thumbnail_cache.stats()
+        self.assertEqual(stats['hits'] + stats['revalidated'] + stats['misses'], 2 * len(devices))
+        self.assertEqual(stats['entries'], len(devices))
+        b.close()
+        # the index is written on close, not after each image
+        cache = blink.ThumbnailCache(path)
+        self.assertEqual(cache.stats()['entries'], len(devices))
+        # concurrent stores of the same image share one file
+        threads = [threading.Thread(target=cache.store, args=('same/%d.jpg' % i, b'image')) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(cache.fresh('same/0.jpg'), None)
+        self.assertEqual(cache.not_modified('same/7.jpg'), b'image')
+        cache.close()
+        self.assertEqual(blink.ThumbnailCache(path).stats()['entries'], len(devices) + 8)
+        self.assertFalse([name for name in os.listdir(path) if name.endswith('.part')])
+        shutil.rmtree(path)
+
+    def test_async_client(self):
+        try:
+            import asyncio
+            from blink_async import AsyncBlink
+        except ImportError:
+            self.skipTest('asyncio client requires python 3 and aiohttp')
+
+        logins = []
+
+        async def run():
+            async with AsyncBlink(self.email, self.password, **self.options) as b:
+                login = b._login
+
+                async def counted():
+                    logins.append(1)
+                    await login()
+                b._login = counted
+                # the concurrent first calls share one login
+                home, events, count, ids = await asyncio.gather(b.homescreen(), b.eventsv2(), b.get_video_count(),
+                                                                b.list_camera_ids())
+                return events, count, ids
+
+        events, count, ids = asyncio.run(run())
+        self.assertEqual(len(logins), 1)
+        self.assertEqual(type(events), list)
+        self.assertEqual(count, self.b.get_video_count())
+        self.assertEqual(ids, self.b.list_camera_ids())
+
 ###############################################################################
 ##  Wrapped Functions
 ###############################################################################
@@ -68,6 +206,23 @@ class TestBlink(unittest.TestCase):
         ids = self.b.list_camera_ids()
         self.assertEqual(type(ids), list)
 
+    def test_get_camera_sensor_info(self):
+        infos = self.b.get_camera_sensor_info()
+        self.assertEqual(len(infos), len(self.b.list_camera_ids()))
+        for info in infos:
+            self.assertTrue('error' not in info)
+        self.assertEqual(self.b.sweep_errors, [])
+
+    def test_topology_cache(self):
+        ids = self.b.list_camera_ids()
+        misses = self.b.topology_misses
+        self.assertEqual(self.b.list_camera_ids(), ids)
+        self.assertEqual(self.b.topology_misses, misses)
+        self.assertTrue(self.b.topology_hits > 0)
+        self.b.invalidate_topology()
+        self.assertEqual(self.b.list_camera_ids(), ids)
+        self.assertTrue(self.b.topology_misses > misses)
+
     def test_events_from_camera(self):
         ids = self.b.list_camera_ids()
         if len(ids) > 0:
@@ -78,8 +233,185 @@ class TestBlink(unittest.TestCase):
                 content = self.b.download_video_v2(event)
                 filename = self.b.get_event_name_v2(event)
                 blink.save_to_file(content, "event_camera_"+filename)
+
+    def test_iter_events(self):
+        events = self.b.eventsv2()
+        if len(events) == 0:
+            return ;
+        since = events[-1].created_at
+        iterated = list(self.b.iter_events(since=since))
+        self.assertEqual([e.id for e in iterated[:len(events)]], [e.id for e in events])
+        for event in self.b.iter_events(camera_id=events[0].camera_id, since=since):
+            self.assertEqual(event.camera_id, events[0].camera_id)
+
+    def test_list_all_events(self):
+        events = self.b.list_all_events()
+        ids = [e.id for e in events]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertTrue(len(events) >= self.b.get_video_count() - len(self.b.eventsv2()))
+
+    def test_sync(self):
+        index = blink.EventIndex()
+        added = self.b.sync(index)
+        self.assertEqual(len(index), len(added))
+        ids = set(e.id for e in added)
+        for event in self.b.sync(index):
+            self.assertTrue(event.id not in ids)
+        for event in added[:1]:
+            self.assertEqual(index.get(event.id)['state'], blink.EventIndex.PENDING)
+        index.close()
+        # a first sync starts at since
+        index = blink.EventIndex()
+        since = sorted(e.created_at for e in added)[len(added) // 2] if added else None
+        first = self.b.sync(index, since=since)
+        self.assertEqual(set(e.id for e in first), set(e.id for e in added if since is None or e.created_at >= since))
+        index.close()
+
+    def test_archive(self):
+        path = tempfile.mkdtemp()
+        stats = self.b.archive(path, downloaders=2)
+        self.assertEqual(stats.failed, 0)
+        self.assertFalse(stats.interrupted)
+        stats = self.b.archive(path)
+        self.assertEqual(stats.downloaded, 0)
+        shutil.rmtree(path)
+
+    def test_change_detection(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('change detection requires numpy')
+        try:
+            import PIL
+            decoder = None
+        except ImportError:
+            # without Pillow, read the bytes of the thumbnails as gray levels
+            decoder = lambda content: numpy.frombuffer(content[:1024], numpy.uint8).reshape(32, 32)
+        detector = blink.ChangeDetector(decoder=decoder)
+        first = self.b.thumbnail_changes(detector)
+        self.assertEqual(set(first.values()), set([1.0]))
+        second = self.b.thumbnail_changes(detector)
+        self.assertEqual(set(second), set(first))
+        self.assertFalse(any(detector.changed(id) for id in second))
+        # a slow drift is scored against the last change, so it adds up to one
+        drift = blink.ChangeDetector(threshold=0.05, decoder=lambda frame: frame)
+        frames = [numpy.full((32, 32), 100 + 4 * i, numpy.uint8) for i in range(8)]
+        scores = drift.scan([('camera', frame) for frame in frames])
+        self.assertEqual([score >= 0.05 for score in scores], [True, False, False, False, True, False, False, False])
+        # a threshold above any score of a known camera keeps only its first clip
+        path = tempfile.mkdtemp()
+        events = self.b.list_all_events()
+        stats = self.b.archive(path, changes=blink.ChangeDetector(threshold=1.0, decoder=decoder))
+        self.assertEqual(stats.downloaded, len(set(event.camera_id for event in events)))
+        self.assertEqual(stats.downloaded + stats.skipped, len(events))
+        shutil.rmtree(path)
+
+    def test_model_extra_keys(self):
+        data = self.b.eventsv2()[0].to_dict()
+        data['source'] = 'pir'
+        event = blink.Event(**data)
+        self.assertEqual(event.source, 'pir')
+        self.assertEqual(event.to_dict(), data)
+        # the overflow dict only holds the unknown keys
+        self.assertEqual(list(event._extra), ['source'])
+        # copying or pickling an event does not parse its timestamp
+        data['created_at'] = 'not a timestamp'
+        event = pickle.loads(pickle.dumps(blink.Event(**data)))
+        self.assertEqual(event.to_dict(), data)
+        self.assertEqual(event._created_at, None)
+
+    def test_archive_resume(self):
+        events = self.b.eventsv2()
+        if len(events) == 0:
+            return ;
+        event = events[0]
+        path = tempfile.mkdtemp()
+        index = blink.EventIndex(os.path.join(path, 'events.db'))
+        # an earlier run indexed the event and failed to download it
+        index.add([event])
+        index.mark_failed(event.id)
+        stats = self.b.archive(path, index=index)
+        self.assertEqual(stats.failed, 0)
+        stored = blink.StoredFile(self.b.get_event_name_v2(event), event)
+        self.assertEqual(index.get(event.id)['path'],
+                         os.path.join(path, blink.DirectorySink(path, '{network}/{name}').relative_path(stored)))
+        index.close()
+        shutil.rmtree(path)
+
+    def test_event_watcher(self):
+        events = self.b.eventsv2()
+        watcher = blink.EventWatcher(self.b, min_interval=1, max_interval=4)
+        self.assertEqual(watcher.poll(0), 0)
+        self.assertEqual(watcher._last_id[0], events[0].id if events else 0)
+        self.assertEqual(watcher.get(timeout=0), None)
+        with watcher:
+            time.sleep(2)
+        self.assertTrue(watcher.polls >= 2)
+        self.assertEqual(watcher.errors, [])
+
+    def test_storage_writer(self):
+        events = self.b.eventsv2()
+        path = tempfile.mkdtemp()
+        stored = []
+        with blink.StorageWriter(blink.ContentAddressedSink(path), fsync_every=2) as writer:
+            for event in events[:4]:
+                writer.submit(self.b.get_thumbnail_name_event(event, "event"), self.b.download_thumbnail_event_v2(event),
+                              event, callback=lambda f, error: stored.append((f, error)))
+        self.assertEqual(len(stored), len(events[:4]))
+        for f, error in stored:
+            self.assertEqual(error, None)
+            self.assertEqual(os.path.getsize(f.location), f.size)
+        # streamed files, an aborted one is not stored
+        streamed = []
+        with blink.StorageWriter(blink.DirectorySink(path), max_inflight_bytes=1024) as writer:
+            for name, abort in [('complete.bin', False), ('aborted.bin', True)]:
+                stream = writer.open(name, callback=lambda f, error: streamed.append((f.name, error is None)))
+                for i in range(16):
+                    self.assertTrue(stream.write(b'x' * 256))
+                if abort:
+                    stream.abort(ValueError('interrupted'))
+                else:
+                    stream.close()
+        self.assertEqual(sorted(streamed), [('aborted.bin', False), ('complete.bin', True)])
+        self.assertEqual(os.path.getsize(os.path.join(path, 'undated', 'complete.bin')), 16 * 256)
+        self.assertFalse(os.path.exists(os.path.join(path, 'undated', 'aborted.bin')))
+        # the same content is stored once
+        with blink.StorageWriter(blink.ContentAddressedSink(path)) as writer:
+            copies = [writer.submit('copy%d.bin' % i, b'same content') for i in range(2)]
+        self.assertEqual(copies[0].location, copies[1].location)
+        self.assertEqual([name for name in os.listdir(path) if name.endswith('.part')], [])
+        shutil.rmtree(path)
+
+    def test_archive_retention(self):
+        path = tempfile.mkdtemp()
+        quota = sum(len(self.b.download_video_v2(event)) for event in self.b.eventsv2()[:2])
+        retention = blink.RetentionPolicy(max_bytes=quota)
+        self.b.archive(path, retention=retention)
+        index = blink.EventIndex(os.path.join(path, 'events.db'))
+        stored = index.stored_bytes
+        self.assertTrue(stored <= quota)
+        retention.max_bytes = 0
+        self.assertEqual(retention.enforce(index, root=path).bytes, stored)
+        self.assertEqual(index.stored_bytes, 0)
+        index.close()
+        shutil.rmtree(path)
+        # a clip inside a rollup archive is evicted with the whole archive
+        path = tempfile.mkdtemp()
+        self.b.archive(path, sink=blink.RollupSink(path))
+        index = blink.EventIndex(os.path.join(path, 'events.db'))
+        stored = index.stored_bytes
+        self.assertTrue(stored > 0)
+        stats = blink.RetentionPolicy(max_bytes=stored - 1).enforce(index, root=path)
+        self.assertEqual((stats.bytes, index.stored_bytes), (stored, 0))
+        self.assertFalse([name for name in os.listdir(path) if name.startswith('rollup-')])
+        index.close()
+        shutil.rmtree(path)
+
     def test_refresh_all_cameras_thumbnail(self):
-        self.b.refresh_all_cameras_thumbnail()
+        results = self.b.refresh_all_cameras_thumbnail()
+        self.assertEqual([r['camera_id'] for r in results], self.b.list_camera_ids())
+        for result in results:
+            self.assertTrue(result['complete'])
         data = self.b.homescreen()
         for device in data['devices']:
             if device['device_type'] is not None and device['device_type'] == "camera":
@@ -88,6 +420,40 @@ class TestBlink(unittest.TestCase):
                 blink.save_to_file(content, filename)
                 print("Download latest thumbnails to " + filename)
 
+    def test_fleet(self):
+        with blink.BlinkFleet([(self.email, self.password)], session_cache=SESSION_CACHE, **self.options) as fleet:
+            self.assertEqual(fleet.connect(), {})
+            self.assertTrue('TOKEN_AUTH' not in fleet.session.headers)
+            self.assertEqual(fleet.list_camera_ids(), {self.email: self.b.list_camera_ids()})
+            infos = fleet.get_camera_sensor_info()
+            self.assertEqual([info['email'] for info in infos], [self.email] * len(self.b.list_camera_ids()))
+
+    def test_metrics(self):
+        metrics = blink.MetricsCollector().attach(self.b)
+        self.b.get_camera_sensor_info()
+        endpoints = metrics.endpoints()
+        stats = endpoints[('GET', 'network/{id}/camera/{id}/signals')]
+        self.assertEqual(stats['count'], len(self.b.list_camera_ids()))
+        self.assertTrue(stats['bytes'] > 0)
+        self.assertTrue('blink_request_duration_seconds_bucket{method="GET",endpoint="network/{id}/camera/{id}/signals",le="+Inf"}' in metrics.to_prometheus())
+
+    def test_scheduler_priority(self):
+        scheduler = blink.RequestScheduler(max_inflight=1)
+        scheduler.acquire()
+        order = []
+        def request(priority):
+            scheduler.acquire(priority)
+            order.append(priority)
+            scheduler.release()
+        threads = [threading.Thread(target=request, args=(p,)) for p in [blink.PRIORITY_BULK, blink.PRIORITY_BULK, blink.PRIORITY_CONTROL]]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.1)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [blink.PRIORITY_CONTROL, blink.PRIORITY_BULK, blink.PRIORITY_BULK])
+
 ###############################################################################
 ##  Other Client APIs
 ###############################################################################
@@ -124,8 +490,121 @@ class TestBlink(unittest.TestCase):
         suc = self.b.delete_video(event.id)
         self.assertTrue(suc)
 
+    def test_delete_videos(self):
+        events = self.b.eventsv2(1000)
+        if len(events) == 0:
+            return ;
+        ids = [event.id for event in events[-2:]]
+        stats = self.b.delete_videos(ids)
+        self.assertEqual(stats.outcomes, dict((id, True) for id in ids))
+        self.assertEqual(self.b.delete_videos(where=lambda event: event.id in ids).outcomes, {})
+
+###############################################################################
+##  The same tests against a local mock server, run without an account
+###############################################################################
+class TestBlinkOffline(TestBlink):
+    email = "offline@example.com"
+    password = "secret"
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from mockserver import MockServer
+        except ImportError:
+            raise unittest.SkipTest('the mock server requires python 3')
+        cls.server = MockServer(networks=2, cameras=2, videos=60, video_size=64*1024, command_delay=0.2).start()
+        cls.options = {'base_url': cls.server.url}
+        # the tests save downloads to the current directory
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.mkdtemp()
+        os.chdir(cls.tmp)
+
+    def test_coalesced_failure(self):
+        b = Blink(self.email, self.password, session_cache=SESSION_CACHE, coalesce_ttl=60, retries=0, **self.options)
+        b.connect()
+        self.server.error_rate = 1.0
+        try:
+            self.assertRaises(blink.BlinkHTTPError, b.get_video_count)
+        finally:
+            self.server.error_rate = 0
+        # the failure is not reused once the server recovered
+        self.assertEqual(b.get_video_count(), self.b.get_video_count())
+
+    def test_sharded_fleet(self):
+        accounts = [('fleet%d@example.com' % i, self.password) for i in range(4)]
+        tokens = len(self.server._tokens)
+        with blink.BlinkFleet(accounts, processes=2, rate_limit=20, **self.options) as fleet:
+            self.assertEqual(fleet.connect(), {})
+            ids = fleet.list_camera_ids()
+            self.assertEqual(ids, dict((email, self.b.list_camera_ids()) for email, password in accounts))
+            self.assertEqual(fleet.run(operator.attrgetter('connected')), [(email, True, None) for email, password in accounts])
+            # the workers split the global limit and keep their logins between operations
+            self.assertEqual(fleet._shard_options['rate_limit'], 10)
+            self.assertEqual(len(self.server._tokens) - tokens, len(accounts))
+        self.server.password = self.password
+        try:
+            with blink.BlinkFleet([('wrong@example.com', 'wrong'), accounts[0]], **self.options) as fleet:
+                ids = fleet.list_camera_ids()
+        finally:
+            self.server.password = None
+        self.assertEqual(list(ids['wrong@example.com']), ['error'])
+        self.assertEqual(ids[accounts[0][0]], self.b.list_camera_ids())
+        # no account gets the cookies of another one through the shared session
+        self.assertEqual(len(fleet.session.cookies), 0)
+
+    def test_retries(self):
+        requests = []
+        self.b.on_request_end.append(requests.append)
+        self.server.error_rate = 1.0
+        try:
+            # a failed command may have been carried out, it is not sent again
+            self.assertRaises(blink.BlinkHTTPError, self.b.arm, self.b.networks[0])
+            self.assertRaises(blink.BlinkHTTPError, self.b.get_video_count)
+        finally:
+            self.server.error_rate = 0
+        self.assertEqual([info.retries for info in requests], [0, self.b._retries])
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.tmp)
+        cls.server.stop()
+
+###############################################################################
+##  Import cost, runs without an account
+###############################################################################
+class TestImport(unittest.TestCase):
+    # cumulative microseconds `python -X importtime` may report for `import blink`
+    budget = 50000
+
+    def run_python(self, *args, **env):
+        environ = dict(os.environ, **env)
+        environ.pop('PYTHONDONTWRITEBYTECODE', None)
+        proc = subprocess.Popen([sys.executable] + list(args), cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=environ)
+        return proc.communicate()
+
+    def test_import_time(self):
+        # compiling the sources is not part of the budget, a first import fills a private bytecode cache
+        cache = tempfile.mkdtemp()
+        try:
+            self.run_python('-c', 'import blink', PYTHONPYCACHEPREFIX=cache)
+            out, err = self.run_python('-X', 'importtime', '-c', 'import blink', PYTHONPYCACHEPREFIX=cache)
+        finally:
+            shutil.rmtree(cache)
+        line = [l for l in err.splitlines() if l.split('|')[-1].strip() == 'blink'][-1]
+        cumulative = int(line.split('|')[1])
+        self.assertLess(cumulative, self.budget, 'import blink took %dus' % cumulative)
+
+    def test_lazy_imports(self):
+        out, err = self.run_python('-c', 'import sys, blink; print(" ".join(sorted(sys.modules)))')
+        for module in ['requests', 'yaml', 'dateutil', 'sqlite3', 'concurrent.futures', 'orjson', 'numpy', 'PIL']:
+            self.assertFalse(module in out.split(), module + ' imported by import blink')
+
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2:
         TestBlink.password = sys.argv.pop()
         TestBlink.email = sys.argv.pop()
-    unittest.main()
+        unittest.main(defaultTest='TestBlink')
+    else:
+        unittest.main(defaultTest=['TestBlinkOffline', 'TestImport'])